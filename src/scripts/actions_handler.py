@@ -1,15 +1,123 @@
+import functools
 import os.path
 import re
 from xml.etree import ElementTree as ET
-# from hashlib import md5
 from heroes_v_file_seeker import *
 from parse_error import ParseError
 
 global_types = globals()
+# Brick classes of xpointers are looked up among these, see classInstanceByXpointerType()
+classInstanceByXpointerType.__globals__['global_types'] = global_types
+
+
+# Chain of bricks being converted to script, from the root brick down to the current one.
+# It's shared by all bricks of the script, so a brick referring to any of its ancestors
+# is found in constant time, whatever the chain depth is
+#
+class BrickChain:
+
+    def __init__(self):
+        self.stack = []  # (identity, brick) pairs
+        self.identities = set()
+
+    def top(self):
+        return self.stack[-1][1] if self.stack else None
+
+    def push(self, brick):
+        identity = brick.identity()
+        if identity in self.identities:
+            start = [chained for chained, _ in self.stack].index(identity)
+            cycle = [chained for _, chained in self.stack[start:]] + [brick]
+            path = ' -> '.join(chained.location() for chained in cycle)
+            raise RecursionError(812, f"Recursive .(Action) objects referring: {path}. Check links logic.")
+        self.stack.append((identity, brick))
+        self.identities.add(identity)
+
+    def pop(self):
+        identity, _ = self.stack.pop()
+        self.identities.discard(identity)
+
+    def emitted(self):
+        # Definitions the script of the root brick is preceded by
+        return []
 
 
-def stringArrayHash(lines):
-    return md5(''.join(lines).encode('UTF-8', errors='ignore')).hexdigest()
+# Script graph: bricks referred by files are shared by all bricks referring them, so each
+# of them is emitted once, as a global Lua function, and called by name. Definitions are
+# collected here while the script is created and go before the script of the root brick.
+# A graph given to several root bricks (e.g. all objects of a map) is shared by them:
+# its definitions go once before all of their scripts, see toScript().
+# Functions are named by bricks identities, so a file referred in any case is emitted once.
+# Talkbox sheets of a dialog are emitted once per dialog and referred by their table fields
+#
+class ScriptGraph(BrickChain):
+
+    def __init__(self):
+        super().__init__()
+        self.functions = {}  # identity: function name
+        self.names = set()
+        self.definitions = []
+        self.sheets = set()  # identities of sheets emitted by the current dialog
+
+    def functionName(self, brick):
+        name = 'Brick_' + re.sub(r'[^A-Za-z0-9_]', '_', os.path.splitext(brick.identity())[0]).strip('_')
+        unique_name = name
+        n = 2
+        while unique_name in self.names:
+            unique_name = f'{name}_{n}'
+            n += 1
+        self.names.add(unique_name)
+        return unique_name
+
+    def function(self, brick):
+        # Name of the function running the brick, defined on the first reference
+        identity = brick.identity()
+        if identity in self.identities:
+            # Brick refers to itself through its children: the same error as for inline scripts
+            self.push(brick)
+        name = self.functions.get(identity)
+        if name is None:
+            name = self.functionName(brick)
+            self.functions[identity] = name
+            body = brick.toScript(1, 0)
+            self.definitions += [f'function {name}({brick.hero}, player)', *body, 'end', '']
+        return name
+
+    def emitted(self):
+        # Definitions are taken by the script they precede, the next script emits these again
+        definitions = self.definitions
+        self.functions = {}
+        self.names = set()
+        self.definitions = []
+        self.sheets = set()
+        return definitions
+
+    def toScript(self, bricks, indentation_level=1):
+        # Script of root bricks sharing the graph, preceded by definitions of all bricks they refer
+        script_contents = []
+        for brick in bricks:
+            script_contents += brick.toScript(indentation_level)
+        return self.emitted() + script_contents
+
+
+def chained(to_script):
+    # Brick is on the chain while its script (and scripts of its children) is created.
+    # Calls of overridden toScript() by super() are a part of the same step.
+    # Script of the root brick is preceded by definitions of all bricks emitted by its graph,
+    # definitions of a graph given to the root brick are left to ScriptGraph.toScript()
+    @functools.wraps(to_script)
+    def wrapper(self, *args, **kwargs):
+        if self.chain.top() is self:
+            return to_script(self, *args, **kwargs)
+        root = self.chain.top() is None and self.owns_chain
+        self.chain.push(self)
+        try:
+            script_contents = to_script(self, *args, **kwargs)
+        finally:
+            self.chain.pop()
+            definitions = self.chain.emitted() if root else []
+        return definitions + script_contents if definitions else script_contents
+    return wrapper
 
 
 """ Classes related to XDB-bricks for Heroes V lua scripts """
@@ -20,34 +128,44 @@ class XmlScriptBrick:
     def __init__(self, xml_element: ET.Element,
                  inspector: HeroesVFileInspector,
                  name: str = '', context: str = '',
-                 usecases_table: set = None,
-                 hero_variable_name: str = 'hero'):
-        if usecases_table is None:
-            self.usecases_table = set()
-        else:
-            self.usecases_table = usecases_table.copy()
+                 chain: ScriptGraph = None,
+                 hero_variable_name: str = 'hero',
+                 file: str = None):
+        # Recursive actions defence and shared bricks: bricks of the script share the graph
+        #
+        self.owns_chain = chain is None
+        self.chain = ScriptGraph() if chain is None else chain
         self.root = xml_element
         self.document = ET.ElementTree(self.root)
         self.hero = hero_variable_name
         self.inspector = inspector
         self.name = name
         self.context = context
+        # File the brick is read from, inline bricks are named by their ids inside it
+        self.file = file if file is not None else '/' + os.path.join(context, name).replace('\\', '/').lstrip('/')
 
-        # Recursive actions defence:
-        #
-        hash = stringArrayHash(ET.tostringlist(self.root, encoding="unicode"))
-        if hash in self.usecases_table:
-            raise RecursionError(812, f"Recursive .(Action) objects referring. Check links logic.")
-        else:
-            self.usecases_table.add(hash)
+    def isReferred(self):
+        # Brick is read from its own file, not inline
+        return self.name == os.path.basename(self.file)
+
+    def location(self):
+        # File path of the brick, followed by its id for inline bricks
+        if self.isReferred():
+            return self.file
+        return f'{self.file}#{self.name}'
+
+    def identity(self):
+        # Files are referred ignoring their case, the way these are resolved
+        return casefoldPath(os.path.normpath(self.location()))
 
     @classmethod
     def fromGameFile(cls, file_rel_path: str,
                      inspector: HeroesVFileInspector,
-                     usecases_table: set = None,
+                     chain: ScriptGraph = None,
                      hero_variable_name: str = 'hero'):
 
-        contents = inspector.get(file_rel_path)
+        # Parsed trees are shared by all bricks of the file, these are never modified
+        root = inspector.parse(file_rel_path)
 
         filepath, filename = os.path.split(file_rel_path)
         name = filename
@@ -58,7 +176,10 @@ class XmlScriptBrick:
         else:
             context = filepath
 
-        return cls(ET.fromstringlist(contents), inspector, name, context, usecases_table, hero_variable_name)
+        # Referred files are read while this brick and its inline children are processed
+        inspector.prefetch(fileReferences(root, context))
+
+        return cls(root, inspector, name, context, chain, hero_variable_name, file_rel_path)
 
     def getChildBrick(self, child_element: ET.Element):
         if child_element is not None:
@@ -73,23 +194,36 @@ class XmlScriptBrick:
                     else:
                         raise AttributeError(f"No inline object id! Failed in {self.name}")
                     return following_brick_class(child_element[0], self.inspector, name, self.context,
-                                                 self.usecases_table, self.hero)
+                                                 self.chain, self.hero, self.file)
                 # Reference
                 else:
                     file_ref = fileReferenceByXpointerType(self.context, href)
                     return following_brick_class.fromGameFile(file_ref, self.inspector,
-                                                              self.usecases_table, self.hero)
+                                                              self.chain, self.hero)
             else:
                 return None
         else:
             raise AttributeError(f"Child brick Element mustn't me None! Failed in: {self.name}")
 
+    def makeAbsolute(self, ref):
+        # Game path of texts and icons referred by the brick
+        return fileReferenceByXpointerType(self.context, ref)
+
+    def childScript(self, child, indentation_level=1, brackets_level=0):
+        # Inline children are a part of the brick script, referred ones are called by name
+        if not child.isReferred():
+            return child.toScript(indentation_level, brackets_level)
+        name = self.chain.function(child)
+        return ['\t' * indentation_level + f'{name}({self.hero}, player)']
+
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
         pass
 
 
 class Condition(XmlScriptBrick):
 
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
 
         tab = '\t' * indentation_level
@@ -186,14 +320,14 @@ class Condition(XmlScriptBrick):
         #
         script_contents_on_true = self.getChildBrick(self.root.find("OnTrue"))
         if script_contents_on_true is not None:
-            script_contents += script_contents_on_true.toScript(indentation_level + 1)
+            script_contents += self.childScript(script_contents_on_true, indentation_level + 1)
 
         # Create callback on statement is lie
         #
         script_contents_on_false = self.getChildBrick(self.root.find("OnFalse"))
         if script_contents_on_false is not None:
             script_contents.append(tab + 'else')
-            script_contents += script_contents_on_false.toScript(indentation_level + 1)
+            script_contents += self.childScript(script_contents_on_false, indentation_level + 1)
 
         # Close if-clause with 'end'
         #
@@ -215,9 +349,10 @@ class ActionShow(Action):
     def __init__(self, xml_element: ET.Element,
                  inspector: HeroesVFileInspector,
                  name: str = '', context: str = '',
-                 usecases_table: set = None,
-                 hero_variable_name: str = 'hero'):
-        super().__init__(xml_element, inspector, name, context, usecases_table, hero_variable_name)
+                 chain: ScriptGraph = None,
+                 hero_variable_name: str = 'hero',
+                 file: str = None):
+        super().__init__(xml_element, inspector, name, context, chain, hero_variable_name, file)
         self.players_filter = self.inspector.getNumericID('players_filter', self.root.find("PlayersFilter").text)
         self.modal = None
         BeModal = self.root.find("BeModal")
@@ -228,6 +363,7 @@ class ActionShow(Action):
 
 class ActionShowMessage(ActionShow):
 
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
         tab = '\t' * indentation_level
         open_bracket = '[' + brackets_level * '=' + '['
@@ -244,7 +380,7 @@ class ActionShowMessage(ActionShow):
         following = self.onEnd()
         if following is not None:
             if self.modal == 'true':
-                following_script = following.toScript(indentation_level, brackets_level + 1)
+                following_script = self.childScript(following, indentation_level, brackets_level + 1)
                 script_contents.append(tab + f'MessageBoxForPlayers({self.players_filter},'
                                              f' "{txt_reference}" {open_bracket}')
                 script_contents += list(map(lambda s: '\t' + s, following_script))
@@ -252,7 +388,7 @@ class ActionShowMessage(ActionShow):
                                              f'-- MessageBox callback waits for function() call')
                 pass
             elif self.modal == 'false':
-                following_script = following.toScript(indentation_level, brackets_level)
+                following_script = self.childScript(following, indentation_level, brackets_level)
                 script_contents.append(tab + f'MessageBoxForPlayers({self.players_filter},'
                                              f' "{txt_reference}")')
                 script_contents += following_script
@@ -265,6 +401,7 @@ class ActionShowMessage(ActionShow):
 
 class ActionShowFlyingSign(ActionShow):
 
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
 
         tab = '\t' * indentation_level
@@ -291,7 +428,7 @@ class ActionShowFlyingSign(ActionShow):
 
         following = self.onEnd()
         if following is not None:
-            script_contents += following.toScript(indentation_level + 1, brackets_level)
+            script_contents += self.childScript(following, indentation_level + 1, brackets_level)
 
         return script_contents
 
@@ -311,6 +448,7 @@ class TalkboxSheet(XmlScriptBrick):
         script_table_field = 'BranchedDialog.Dialogs.' + '.'.join(keys)
         return script_table_field
 
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
 
         tab = '\t' * indentation_level
@@ -319,6 +457,7 @@ class TalkboxSheet(XmlScriptBrick):
         close_bracket = ']' + brackets_level * '=' + ']'
         script_contents = []
         tables = []
+        self.chain.sheets.add(self.identity())
 
         script_table_field = self.scriptTableFieldName()
         keys = self.__splitPath()
@@ -380,14 +519,16 @@ class TalkboxSheet(XmlScriptBrick):
             action = self.getChildBrick(item.find("OnChoose"))
             if action is not None:
                 script_contents.append(tab + 3 * '\t' + "action = function()")
-                script_contents += action.toScript(indentation_level + 4, brackets_level)
+                script_contents += self.childScript(action, indentation_level + 4, brackets_level)
                 script_contents.append(tab + 3 * '\t' + "end,")
 
             following: TalkboxSheet = self.getChildBrick(item.find("FollowingSheet"))
             if following is not None:
                 following_sheet_name = following.scriptTableFieldName()
                 script_contents.append(tab + 3 * '\t' + 'following = "' + following_sheet_name + '"')
-                tables.append(following.toScript(indentation_level, brackets_level))
+                # Sheets the dialog loops back to are already emitted
+                if following.identity() not in self.chain.sheets:
+                    tables.append(following.toScript(indentation_level, brackets_level))
 
             script_contents.append(tab + 2 * '\t' + "},")
 
@@ -404,6 +545,7 @@ class TalkboxSheet(XmlScriptBrick):
 
 class ActionShowBranchedDialog(ActionShow):
 
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
 
         tab = '\t' * indentation_level
@@ -415,7 +557,7 @@ class ActionShowBranchedDialog(ActionShow):
         if following is not None:
             script_contents.append(tab + '-- Functions to be called after whole BranchDialog ends')
             script_contents.append(tab + 'local callback = function()')
-            script_contents += following.toScript(indentation_level + 1)
+            script_contents += self.childScript(following, indentation_level + 1)
             script_contents.append(tab + 'end')
 
         start_sheet: TalkboxSheet = self.getChildBrick(self.root.find("StartSheet"))
@@ -424,7 +566,12 @@ class ActionShowBranchedDialog(ActionShow):
         script_contents.append(tab + '-- Branched dialog separate pages are created in BranchedDialog.Dialogs')
         script_contents.append(tab + '-- and accessed by string path then')
         script_contents.append(tab + '--')
-        script_contents += start_sheet.toScript(indentation_level, brackets_level)
+        # Sheets are emitted once per dialog, tables of other dialogs are created by these
+        sheets, self.chain.sheets = self.chain.sheets, set()
+        try:
+            script_contents += start_sheet.toScript(indentation_level, brackets_level)
+        finally:
+            self.chain.sheets = sheets
         script_contents.append(tab + '-- Finally, call dialog creator to run.')
         script_contents.append(tab + '--')
 
@@ -443,6 +590,7 @@ class ActionShowBranchedDialog(ActionShow):
 
 class ActionShowLinearDialog(ActionShow):
 
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
         tab = '\t' * indentation_level
         script_contents = []
@@ -451,7 +599,7 @@ class ActionShowLinearDialog(ActionShow):
         if following is not None:
             script_contents.append(tab + '-- Functions to be called after whole LinearDialog ends')
             script_contents.append(tab + 'local callback = function()')
-            script_contents += following.toScript(indentation_level + 1)
+            script_contents += self.childScript(following, indentation_level + 1)
             script_contents.append(tab + 'end')
 
         script_contents.append(tab + 'local sentences = {')
@@ -516,7 +664,7 @@ class AdvMapObjectBase(XmlScriptBrick):
 
         return object_script_name
 
-    def __getValidScriptName(self):
+    def getValidScriptName(self):
         from re import match, sub
         valid_string = sub(r"[^A-Za-z0-9_]", '', self.getScriptName())
         if match(r"^[0-9]", valid_string):
@@ -525,6 +673,7 @@ class AdvMapObjectBase(XmlScriptBrick):
             raise ValueError(f"No valid script name could be constructed! Failed in {self.name}")
         return valid_string
 
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
         return []
 
@@ -537,12 +686,13 @@ class AdvMapInteractiveBase(AdvMapObjectBase):
     def onRemove(self):
         return self.getChildBrick(self.root.find("Behaviour/OnRemove"))
 
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
 
         tab = '\t' * indentation_level
         script_contents = []
 
-        variable_name = self.__getValidScriptName()
+        variable_name = self.getValidScriptName()
         object_script_name = self.getScriptName()
 
         action_on_touch = self.onTouch()
@@ -551,7 +701,7 @@ class AdvMapInteractiveBase(AdvMapObjectBase):
             script_contents += map(lambda s: tab + s, [
                 "-- Touch handler",
                 f"function {variable_name}_onTouch(hero, object)",
-                *action_on_touch.toScript(indentation_level + 1, brackets_level),
+                *self.childScript(action_on_touch, indentation_level + 1, brackets_level),
                 "end",
                 "",
                 f"AddEventHandler(EVENT_OBJECT_TOUCHED, '{object_script_name}', \"{variable_name}_onTouch\")",
@@ -563,7 +713,7 @@ class AdvMapInteractiveBase(AdvMapObjectBase):
             script_contents += map(lambda s: tab + s, [
                 "-- Touch handler",
                 f"function {variable_name}_onRemove(hero, object)",
-                *action_on_touch.toScript(indentation_level + 1, brackets_level),
+                *self.childScript(action_on_remove, indentation_level + 1, brackets_level),
                 "end",
                 "",
                 f"AddEventHandler(EVENT_OBJECT_REMOVED, '{object_script_name}', {variable_name}_onRemove)",
@@ -578,13 +728,14 @@ class AdvMapInteractiveAndOwnedBase(AdvMapInteractiveBase):
     def onCapture(self):
         return self.getChildBrick(self.root.find("Behaviour/OnCapture"))
 
+    @chained
     def toScript(self, indentation_level=1, brackets_level=0):
         script_contents_old = super().toScript(indentation_level, brackets_level)
 
         tab = '\t' * indentation_level
         script_contents = []
 
-        variable_name = self.__getValidScriptName()
+        variable_name = self.getValidScriptName()
         object_script_name = self.getScriptName()
 
         action_on_capture = self.onCapture()
@@ -592,7 +743,7 @@ class AdvMapInteractiveAndOwnedBase(AdvMapInteractiveBase):
             script_contents += map(lambda s: tab + s, [
                 "-- Touch handler",
                 f"function {variable_name}_onCapture(hero, object, old_owner, new_owner)",
-                *action_on_capture.toScript(indentation_level + 1, brackets_level),
+                *self.childScript(action_on_capture, indentation_level + 1, brackets_level),
                 "end",
                 "",
                 f"AddEventHandler(EVENT_OBJECT_CAPTURED, '{object_script_name}', {variable_name}_onCapture)",
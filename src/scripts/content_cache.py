@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+
+
+class ContentCache:
+    # Contents of game files within a memory budget (in bytes). Least recently
+    # used contents are evicted first. Keys are (relative path, source fingerprint)
+    # pairs, so the whole source may be invalidated once it's changed.
+    # Thread safe cache is locked on every access
+    #
+    def __init__(self, budget=64 * 1024 * 1024, thread_safe=False):
+        self.budget = budget
+        self.__lock = threading.Lock() if thread_safe else nullcontext()
+        self.__entries = OrderedDict()
+        self.resident = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.__lock:
+            cached = self.__entries.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+
+    def __contains__(self, key):
+        # Presence check, neither counted as a hit or a miss nor refreshing the entry
+        with self.__lock:
+            return key in self.__entries
+
+    def put(self, key, contents, size):
+        # Contents larger than the whole budget are never cached
+        if size > self.budget:
+            return
+        with self.__lock:
+            self.__discard(key)
+            self.__entries[key] = (contents, size)
+            self.resident += size
+            while self.resident > self.budget:
+                _, (_, evicted_size) = self.__entries.popitem(last=False)
+                self.resident -= evicted_size
+                self.evictions += 1
+
+    def __discard(self, key):
+        cached = self.__entries.pop(key, None)
+        if cached is not None:
+            self.resident -= cached[1]
+
+    def discard(self, key):
+        with self.__lock:
+            self.__discard(key)
+
+    def invalidate(self, fingerprint):
+        # Drop cached contents of the changed source
+        with self.__lock:
+            for key in [key for key in self.__entries.keys() if key[1] == fingerprint]:
+                self.__discard(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.resident = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def hitRate(self):
+        requests = self.hits + self.misses
+        if requests == 0:
+            return 0.0
+        return round(self.hits / requests * 100, 2)
+
+    def stats(self):
+        return {
+            'entries': len(self.__entries),
+            'resident': self.resident,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hitRate(),
+        }
@@ -1,13 +1,22 @@
+import io
 import os
+import mmap
+import struct
+import threading
+import weakref
 import zipfile
+import zlib
 from datetime import datetime
 import time
-from whoosh.index import create_in, open_dir
-from whoosh.fields import Schema, ID
-from whoosh.qparser import QueryParser
+from collections import OrderedDict
+from src.scripts.inflate_cache import InflateCache
+from src.scripts.seeker_stats import SeekerStats, instrumented
+from typing import NamedTuple
 
 
 class SimpleSeeker:
+    # Shared SeekerStats, if the seeker is instrumented
+    instrumentation: SeekerStats = None
 
     def __init__(self, root):
         if os.path.isdir(root):
@@ -15,15 +24,72 @@ class SimpleSeeker:
         else:
             raise FileNotFoundError(808, "Invalid root directory: " + root)
 
+    def sourceName(self):
+        return self.root
+
+    def setInstrumentation(self, instrumentation: SeekerStats):
+        self.instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.register(self.sourceName(), type(self).__name__)
+
+    def _count(self, counter, value=1):
+        if self.instrumentation is not None:
+            self.instrumentation.count(self.sourceName(), counter, value)
+
+    def stats(self):
+        if self.instrumentation is None:
+            return {}
+        return self.instrumentation.stats(self.sourceName())
+
     def getmtime(self, relative_path):
         pass
 
     def getfile(self, relative_path):
         pass
 
+    def get_bytes(self, relative_path, cache=True):
+        # Raw contents of the file. One-off reads pass 'cache' False, so that shared caches
+        # of the seeker aren't filled with them
+        pass
+
+    def get_view(self, relative_path):
+        return memoryview(self.get_bytes(relative_path))
+
+    def open_stream(self, relative_path):
+        return io.BytesIO(self.get_bytes(relative_path))
+
+    def splitLines(self, contents):
+        # Lines of raw contents, the way getfile() provides them
+        return io.BytesIO(contents).readlines()
+
+    def getmtime_many(self, relative_paths):
+        # Modification times of all given paths at once (0.0 for missing files)
+        return {relative_path: self.getmtime(relative_path) for relative_path in relative_paths}
+
+    def contains_many(self, relative_paths):
+        return {relative_path: mtime > 0.0 for relative_path, mtime in self.getmtime_many(relative_paths).items()}
+
+    def getoffset_many(self, relative_paths):
+        # Locations of files inside the source, files are read in that order
+        return {relative_path: 0 for relative_path in relative_paths}
+
+    def get_bytes_many(self, relative_paths, cache=True):
+        # Yields (relative path, contents) pairs, reading files in their on-disk order
+        offsets = self.getoffset_many(relative_paths)
+        for relative_path in sorted(offsets.keys(), key=offsets.get):
+            yield relative_path, self.get_bytes(relative_path, cache)
+
+    def entries(self):
+        # Yields (relative path, modification time) pairs of all files the seeker can provide
+        return []
+
+    def close(self):
+        pass
+
 
 class FolderSeeker(SimpleSeeker):
 
+    @instrumented('getmtime')
     def getmtime(self, relative_path):
         # print(f"> Searching for last version of '{relative_path}' in folder '{self.root}'")
         abs_path = os.path.join(self.root, relative_path)
@@ -32,6 +98,7 @@ class FolderSeeker(SimpleSeeker):
             # print(f"> Found file in folder '{abs_path}' ({datetime.fromtimestamp(self.lastModificationTime)})")
         return 0.0
 
+    @instrumented('getfile')
     def getfile(self, relative_path):
         # print(f"> Searching for last version of '{relative_path}' in folder '{self.root}'")
         abs_path = os.path.join(self.root, relative_path)
@@ -45,28 +112,243 @@ class FolderSeeker(SimpleSeeker):
             raise FileNotFoundError(f"No file '{relative_path}' found in '{self.root}'")
         return contents
 
+    def __existing(self, relative_path):
+        abs_path = os.path.join(self.root, relative_path)
+        if not os.path.isfile(abs_path):
+            raise FileNotFoundError(f"No file '{relative_path}' found in '{self.root}'")
+        return abs_path
+
+    @instrumented('get_bytes')
+    def get_bytes(self, relative_path, cache=True):
+        with open(self.__existing(relative_path), 'rb') as lastSeekedFile:
+            contents = lastSeekedFile.read()
+        self._count('files_read')
+        self._count('bytes_read', len(contents))
+        return contents
+
+    @instrumented('get_view')
+    def get_view(self, relative_path):
+        # File is mapped into memory, nothing is read until the view is used
+        with open(self.__existing(relative_path), 'rb') as lastSeekedFile:
+            if os.fstat(lastSeekedFile.fileno()).st_size == 0:
+                return memoryview(b'')
+            return memoryview(mmap.mmap(lastSeekedFile.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def open_stream(self, relative_path):
+        return open(self.__existing(relative_path), 'rb')
+
+    def splitLines(self, contents):
+        # Text lines with universal newlines, as the file is read in text mode
+        return io.StringIO(contents.decode('utf-8'), newline=None).readlines()
+
+    def entries(self):
+        directories = [self.root]
+        while directories:
+            with os.scandir(directories.pop()) as directory:
+                for entry in directory:
+                    if entry.is_dir():
+                        directories.append(entry.path)
+                    elif entry.is_file():
+                        relative_path = os.path.relpath(entry.path, self.root).replace("\\", "/")
+                        yield relative_path, entry.stat().st_mtime
+
 
 def formatToArchivePath(relative_path):
     # Reduce relative path to the form ZipFile.namelist() provides:
     # No start slash, all slashes straight '/'
     #
+    relative_path = relative_path.replace("\\", "/")
     if relative_path.startswith("/"):
         relative_path = relative_path.replace("/", '', 1)
-    relative_path = relative_path.replace("\\", "/")
     return relative_path
 
 
+def archiveFingerprint(archive_path):
+    file_info = os.stat(archive_path)
+    return file_info.st_size, file_info.st_mtime_ns
+
+
+# Name -> ZipInfo indexes of archives as {archive path: (fingerprint, index)}
+#
+_archive_name_indexes = {}
+
+
+class ArchiveHandlePool:
+    # Opened archives shared between seekers. No more than 'max_open' files
+    # are kept opened: the least recently used one is closed to open another.
+    # Unlimited if 'max_open' is None
+    #
+    def __init__(self, max_open=16):
+        if max_open is not None and max_open < 1:
+            raise ValueError(f"Invalid opened archives limit: {max_open}")
+        self.max_open = max_open
+        self.__handles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, key, factory):
+        handle = self.__handles.get(key)
+        if handle is not None:
+            self.__handles.move_to_end(key)
+            self.hits += 1
+            return handle
+
+        self.misses += 1
+        handle = factory()
+        self.__handles[key] = handle
+        while self.max_open is not None and len(self.__handles) > self.max_open:
+            _, evicted = self.__handles.popitem(last=False)
+            self.__close(evicted)
+            self.evictions += 1
+        return handle
+
+    @staticmethod
+    def __close(handle):
+        try:
+            handle.close()
+        except BufferError:
+            # Mapped archive is still viewed, it's unmapped once all views are released
+            pass
+
+    def discard(self, archive_path):
+        # Close all handles of the archive (e.g. when it has been changed)
+        for key in [key for key in self.__handles.keys() if key[0] == archive_path]:
+            self.__close(self.__handles.pop(key))
+
+    def clear(self):
+        while self.__handles:
+            _, handle = self.__handles.popitem()
+            self.__close(handle)
+
+    def __len__(self):
+        return len(self.__handles)
+
+    def stats(self):
+        return {
+            'open': len(self.__handles),
+            'max_open': self.max_open,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class ThreadArchiveHandlePool:
+    # Opened archives of each thread in its own pool, so that threads never share
+    # file positions. Discarded and cleared handles of other threads are closed by
+    # these threads on their next acquire, so no handle is closed while it's read
+    #
+    def __init__(self, max_open=16):
+        if max_open is not None and max_open < 1:
+            raise ValueError(f"Invalid opened archives limit: {max_open}")
+        self.max_open = max_open
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        # Pools of finished threads are dropped along with their handles
+        self.__pools = weakref.WeakSet()
+        # Releases are numbered by generations, each thread keeps the last one it has applied.
+        # Discarded archive paths are kept with their last generations until the next clear
+        self.__generation = 0
+        self.__cleared = 0
+        self.__discarded = {}
+
+    def __pool(self):
+        pool = getattr(self.__local, 'pool', None)
+        if pool is None:
+            pool = ArchiveHandlePool(self.max_open)
+            with self.__lock:
+                self.__pools.add(pool)
+                self.__local.released = self.__generation
+            self.__local.pool = pool
+        elif self.__local.released < self.__generation:
+            with self.__lock:
+                released = self.__local.released
+                cleared = self.__cleared > released
+                discarded = [archive_path for archive_path, generation in self.__discarded.items()
+                             if generation > released]
+                self.__local.released = self.__generation
+            if cleared:
+                pool.clear()
+            else:
+                for archive_path in discarded:
+                    pool.discard(archive_path)
+        return pool
+
+    def acquire(self, key, factory):
+        return self.__pool().acquire(key, factory)
+
+    def discard(self, archive_path):
+        with self.__lock:
+            self.__generation += 1
+            self.__discarded[archive_path] = self.__generation
+        self.__pool()
+
+    def clear(self):
+        with self.__lock:
+            self.__generation += 1
+            self.__cleared = self.__generation
+            self.__discarded = {}
+        self.__pool()
+
+    def __len__(self):
+        with self.__lock:
+            return sum(len(pool) for pool in self.__pools)
+
+    def stats(self):
+        with self.__lock:
+            pools = [pool.stats() for pool in self.__pools]
+        return {
+            'open': sum(stats['open'] for stats in pools),
+            'max_open': self.max_open,
+            'hits': sum(stats['hits'] for stats in pools),
+            'misses': sum(stats['misses'] for stats in pools),
+            'evictions': sum(stats['evictions'] for stats in pools),
+            'threads': len(pools),
+        }
+
+
 class ArchivesSeeker(SimpleSeeker):
+    handle_kind = 'zip'
+    # Shared on-disk cache of inflated entries, if it's used
+    inflate_cache: InflateCache = None
 
-    def __init__(self, root, archive):
+    def __init__(self, root, archive, pool: ArchiveHandlePool = None):
         super().__init__(root)
         self.archive_path = os.path.join(root, archive)
+        self.pool = pool
         self.__opened_archive = None
+        self.__names = None
         self._hold_mode = False
 
+    def sourceName(self):
+        return self.archive_path
+
+    def setInflateCache(self, inflate_cache: InflateCache):
+        self.inflate_cache = inflate_cache
+
+    def _cached(self, entry):
+        # Inflated contents of the entry (ArchiveEntry or ZipInfo) from the inflate cache, or None
+        if self.inflate_cache is None or not self.inflate_cache.accepts(entry):
+            return None
+        contents = self.inflate_cache.get(entry)
+        self._count('inflate_cache_misses' if contents is None else 'inflate_cache_hits')
+        return contents
+
+    def _cache(self, entry, contents):
+        if self.inflate_cache is not None:
+            self.inflate_cache.put(entry, contents)
+
+    def _create_handle(self):
+        self._count('archives_opened')
+        self._count('central_directories_parsed')
+        return zipfile.ZipFile(self.archive_path, 'r')
+
     def _open_archive(self):
+        if self.pool is not None:
+            return self.pool.acquire((self.archive_path, self.handle_kind), self._create_handle)
         if self.__opened_archive is None:
-            self.__opened_archive = zipfile.ZipFile(self.archive_path, 'r')
+            self.__opened_archive = self._create_handle()
         return self.__opened_archive
 
     def _close_archive(self):
@@ -77,15 +359,31 @@ class ArchivesSeeker(SimpleSeeker):
         finally:
             self.__opened_archive = None
 
-    def __del__(self):
+    def _release_archive(self):
+        # Pooled archives are closed by the pool, held ones - on seeker free
+        if self.pool is None and not self._hold_mode:
+            self._close_archive()
+
+    def _discard_archive(self):
+        # Close pooled and own handles of the archive
+        if self.pool is not None:
+            self.pool.discard(self.archive_path)
         if self.__opened_archive:
             self._close_archive()
 
+    def close(self):
+        if self.__opened_archive:
+            self._close_archive()
+
+    def __del__(self):
+        self.close()
+
     def __enter__(self):
         self._open_archive()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._close_archive()
+        if self.pool is None:
+            self._close_archive()
 
     def hold(self):
         if not self._hold_mode:
@@ -99,84 +397,331 @@ class ArchivesSeeker(SimpleSeeker):
         else:
             raise RuntimeError(f'Archive seeker ({self.archive_path}) already freed!')
 
+    def _names(self):
+        # Name -> ZipInfo index is built once per archive version and shared by all seekers
+        if self.__names is None:
+            fingerprint = archiveFingerprint(self.archive_path)
+            shared = _archive_name_indexes.get(self.archive_path)
+            if shared is None or shared[0] != fingerprint:
+                if shared is not None:
+                    # The archive has been changed, its opened handles read the previous central directory
+                    self._discard_archive()
+                archive = self._open_archive()
+                shared = (fingerprint, {fileinfo.filename: fileinfo for fileinfo in archive.infolist()})
+                _archive_name_indexes[self.archive_path] = shared
+                self._count('name_indexes_built')
+                self._release_archive()
+            self.__names = shared[1]
+        return self.__names
+
+    @instrumented('getmtime')
     def getmtime(self, relative_path):
+        fileinfo = self._names().get(formatToArchivePath(relative_path))
+        if fileinfo is None:
+            return 0.0
+        return datetime(*fileinfo.date_time).timestamp()
+
+    @instrumented('getmtime_many')
+    def getmtime_many(self, relative_paths):
+        names = self._names()
+        modification_times = {}
+        for relative_path in relative_paths:
+            fileinfo = names.get(formatToArchivePath(relative_path))
+            modification_times[relative_path] = 0.0 if fileinfo is None \
+                else datetime(*fileinfo.date_time).timestamp()
+        return modification_times
+
+    @instrumented('contains_many')
+    def contains_many(self, relative_paths):
+        names = self._names()
+        return {relative_path: formatToArchivePath(relative_path) in names for relative_path in relative_paths}
+
+    def getoffset_many(self, relative_paths):
+        return {relative_path: self.__fileinfo(relative_path).header_offset for relative_path in relative_paths}
+
+    def __fileinfo(self, relative_path):
+        fileinfo = self._names().get(formatToArchivePath(relative_path))
+        if fileinfo is None:
+            raise FileNotFoundError(f"No file '{relative_path}' found in archive '{self.archive_path}'")
+        return fileinfo
 
-        archive = self._open_archive()
-        relative_path = formatToArchivePath(relative_path)
-        modificationTime = 0.0
-
-        if relative_path in archive.namelist():
-            modificationTime = datetime(*archive.getinfo(relative_path).date_time).timestamp()
-        if not self._hold_mode:
-            self._close_archive()
-
-        return modificationTime
+    def _entry(self, relative_path):
+        return ArchiveEntry.fromZipInfo(self.__fileinfo(relative_path))
 
+    @instrumented('getfile')
     def getfile(self, relative_path):
+        fileinfo = self.__fileinfo(relative_path)
 
         archive = self._open_archive()
-        relative_path = formatToArchivePath(relative_path)
-        contents = None
-
-        if relative_path in archive.namelist():
-            lastSoughtFile = archive.open(relative_path, 'r')
-            contents = lastSoughtFile.readlines()
-            # list(map( lambda bstr: bstr.decode("utf-8", errors='ignore').replace('\r\n', '\n'),
-            # lastSoughtFile.readlines()) )
-            lastSoughtFile.close()
+        try:
+            with archive.open(fileinfo, 'r') as lastSoughtFile:
+                contents = lastSoughtFile.readlines()
+                # list(map( lambda bstr: bstr.decode("utf-8", errors='ignore').replace('\r\n', '\n'),
+                # lastSoughtFile.readlines()) )
+        finally:
+            self._release_archive()
 
-        if not self._hold_mode:
-            self._close_archive()
+        return contents
 
-        if contents is None:
-            raise FileNotFoundError(f"No file '{relative_path}' found in archive '{self.archive_path}'")
+    @instrumented('get_bytes')
+    def get_bytes(self, relative_path, cache=True):
+        fileinfo = self.__fileinfo(relative_path)
+        contents = self._cached(fileinfo)
+        if contents is not None:
+            return contents
+        archive = self._open_archive()
+        try:
+            contents = archive.read(fileinfo)
+        finally:
+            self._release_archive()
+        self._countEntry(fileinfo.compress_type, fileinfo.compress_size, fileinfo.file_size)
+        if cache:
+            self._cache(fileinfo, contents)
         return contents
 
+    def _countEntry(self, compress_type, compress_size, file_size):
+        if self.instrumentation is not None:
+            self._count('entries_read')
+            self._count('bytes_read', compress_size)
+            if compress_type != zipfile.ZIP_STORED:
+                self._count('bytes_inflated', file_size)
+
+    def _create_map(self):
+        self._count('archives_mapped')
+        with open(self.archive_path, 'rb') as archive_file:
+            return mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _map_archive(self):
+        if self.pool is not None:
+            return self.pool.acquire((self.archive_path, 'map'), self._create_map)
+        return self._create_map()
+
+    @instrumented('get_view')
+    def get_view(self, relative_path):
+        # Stored entries are served as slices of the mapped archive, others are inflated
+        # or viewed in the inflate cache
+        entry = self._entry(relative_path)
+        if entry.compress_type != zipfile.ZIP_STORED:
+            if self.inflate_cache is not None and self.inflate_cache.accepts(entry):
+                view = self.inflate_cache.view(entry)
+                if view is not None:
+                    self._count('inflate_cache_hits')
+                    return view
+            return memoryview(self.get_bytes(relative_path))
+        self._count('mapped_views')
+        mapped = self._map_archive()
+        local_header = mapped[entry.header_offset:entry.header_offset + zipfile.sizeFileHeader]
+        start = entryDataOffset(local_header, entry, self.archive_path)
+        return memoryview(mapped)[start:start + entry.file_size]
+
+    @instrumented('open_stream')
+    def open_stream(self, relative_path):
+        entry = self._entry(relative_path)
+        self._count('streams_opened')
+        if entry.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            with zipfile.ZipFile(self.archive_path, 'r') as archive:
+                return archive.open(entry.name)
+        return io.BufferedReader(EntryStream(self.archive_path, entry))
+
+    def entries(self):
+        for fileinfo in self._names().values():
+            if not fileinfo.is_dir():
+                yield fileinfo.filename, datetime(*fileinfo.date_time).timestamp()
+
+
+# Location of a single archive entry, as stored in its central directory record
+#
+class ArchiveEntry(NamedTuple):
+    name: str
+    header_offset: int
+    compress_size: int
+    file_size: int
+    compress_type: int
+    CRC: int
+    mtime: float
+
+    @classmethod
+    def fromZipInfo(cls, fileinfo: zipfile.ZipInfo):
+        return cls(fileinfo.filename, fileinfo.header_offset, fileinfo.compress_size, fileinfo.file_size,
+                   fileinfo.compress_type, fileinfo.CRC, datetime(*fileinfo.date_time).timestamp())
+
+
+def entryDataOffset(local_header, entry: ArchiveEntry, archive_path=''):
+    # Entry data follows its local header, which name and extra field
+    # lengths may differ from the central directory ones
+    fields = struct.unpack(zipfile.structFileHeader, local_header)
+    if fields[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local header of '{entry.name}' in '{archive_path}'")
+    return entry.header_offset + zipfile.sizeFileHeader + fields[-2] + fields[-1]
+
+
+class EntryStream(io.RawIOBase):
+    # Stored or deflated archive entry, read and inflated on the fly by chunks.
+    # Stream has its own archive file handle, so it isn't affected by pooled ones
+    #
+    chunk_size = 64 * 1024
+
+    def __init__(self, archive_path, entry: ArchiveEntry):
+        super().__init__()
+        self.archive_path = archive_path
+        self.entry = entry
+        self.__file = open(archive_path, 'rb')
+        self.__file.seek(entry.header_offset)
+        self.__file.seek(entryDataOffset(self.__file.read(zipfile.sizeFileHeader), entry, archive_path))
+        self.__left = entry.compress_size
+        self.__inflater = zlib.decompressobj(-zlib.MAX_WBITS) \
+            if entry.compress_type == zipfile.ZIP_DEFLATED else None
+        self.__crc = 0
+        self.__pending = b''
+        self.__position = 0
+
+    def readable(self):
+        return True
+
+    def __fill(self):
+        # Read next chunk, returns False at the end of the entry
+        if self.__left == 0:
+            return False
+        data = self.__file.read(min(self.__left, self.chunk_size))
+        if not data:
+            raise EOFError(f"Archive '{self.archive_path}' is truncated in '{self.entry.name}'")
+        self.__left -= len(data)
+        if self.__inflater is not None:
+            data = self.__inflater.decompress(data)
+            if self.__left == 0:
+                data += self.__inflater.flush()
+        self.__crc = zlib.crc32(data, self.__crc)
+        if self.__left == 0 and self.__crc != self.entry.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 of '{self.entry.name}' in '{self.archive_path}'")
+        self.__pending = data
+        self.__position = 0
+        return True
+
+    def readinto(self, buffer):
+        while self.__position == len(self.__pending):
+            if not self.__fill():
+                return 0
+        size = min(len(buffer), len(self.__pending) - self.__position)
+        buffer[:size] = self.__pending[self.__position:self.__position + size]
+        self.__position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.__file.close()
+        super().close()
+
+
+def readArchive(archive_path):
+    # Entries of archive central directory
+    entries = []
+    with zipfile.ZipFile(archive_path, 'r') as archive:
+        for fileinfo in archive.infolist():
+            if fileinfo.is_dir():
+                continue
+            try:
+                entries.append(ArchiveEntry.fromZipInfo(fileinfo))
+            except Exception as error:
+                print(f"<ERROR> Uknown error while processing '{fileinfo.filename}'!")
+                print("<ERROR:", error, ">")
+    return entries
+
 
 class IndexedArchiveSeeker(ArchivesSeeker):
+    # Reads archive entries straight from their local headers, using positions
+    # stored in the archive entries index. The central directory is never parsed
+    #
+    handle_kind = 'raw'
 
-    def __init__(self, root, archive, index):
-        super().__init__(root, archive)
+    def __init__(self, root, archive, index, pool: ArchiveHandlePool = None):
+        # 'index' provides lookup(), lookup_many() and iteration of entries (e.g. a catalogued source)
+        super().__init__(root, archive, pool)
+        self.index = index
 
-        if not os.path.exists(index):
-            raise FileNotFoundError(f"{index} is not an index")
+    def _create_handle(self):
+        self._count('archives_opened')
+        return open(self.archive_path, 'rb')
 
-        self.ix = open_dir(index)
-        self.schema = self.ix.schema
+    def _entry(self, relative_path):
+        entry = self.index.lookup(formatToArchivePath(relative_path))
+        if entry is None:
+            raise FileNotFoundError(f"Index search result not found in {self.archive_path}")
+        return entry
 
-    def getmtime(self, relative_path):
-        lastmtime = 0.0
-        with self.ix.searcher() as searcher:
-            query = QueryParser('filepath', self.schema).parse(relative_path)
-            results = searcher.search(query)
-            for result in results:
-                mtime = float(result['mtime'])
-                if mtime > lastmtime:
-                    lastmtime = mtime
+    def _read_entry(self, handle, entry: ArchiveEntry):
+        handle.seek(entry.header_offset)
+        handle.seek(entryDataOffset(handle.read(zipfile.sizeFileHeader), entry, self.archive_path))
+        data = handle.read(entry.compress_size)
+
+        if entry.compress_type == zipfile.ZIP_STORED:
+            contents = data
+        elif entry.compress_type == zipfile.ZIP_DEFLATED:
+            contents = zlib.decompress(data, -zlib.MAX_WBITS)
+        else:
+            # Rare compression methods are left to zipfile
+            self._count('zipfile_fallbacks')
+            self._count('central_directories_parsed')
+            with zipfile.ZipFile(self.archive_path, 'r') as archive:
+                return archive.read(entry.name)
+
+        if zlib.crc32(contents) != entry.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 of '{entry.name}' in '{self.archive_path}'")
+        self._countEntry(entry.compress_type, entry.compress_size, entry.file_size)
+        return contents
 
-        return lastmtime
+    @instrumented('getmtime')
+    def getmtime(self, relative_path):
+        entry = self.index.lookup(formatToArchivePath(relative_path))
+        if entry is None:
+            return 0.0
+        return entry.mtime
+
+    @instrumented('getmtime_many')
+    def getmtime_many(self, relative_paths):
+        paths = {relative_path: formatToArchivePath(relative_path) for relative_path in relative_paths}
+        entries = self.index.lookup_many(paths.values())
+        return {relative_path: entries[name].mtime if name in entries else 0.0 for relative_path, name in paths.items()}
+
+    @instrumented('contains_many')
+    def contains_many(self, relative_paths):
+        paths = {relative_path: formatToArchivePath(relative_path) for relative_path in relative_paths}
+        entries = self.index.lookup_many(paths.values())
+        return {relative_path: name in entries for relative_path, name in paths.items()}
+
+    def getoffset_many(self, relative_paths):
+        paths = {relative_path: formatToArchivePath(relative_path) for relative_path in relative_paths}
+        entries = self.index.lookup_many(paths.values())
+        missing = [relative_path for relative_path, name in paths.items() if name not in entries]
+        if missing:
+            raise FileNotFoundError(f"Index search result not found in {self.archive_path}: {missing}")
+        return {relative_path: entries[name].header_offset for relative_path, name in paths.items()}
+
+    @instrumented('get_bytes')
+    def get_bytes(self, relative_path, cache=True):
+        entry = self._entry(relative_path)
+        contents = self._cached(entry)
+        if contents is not None:
+            return contents
+        handle = self._open_archive()
+        try:
+            contents = self._read_entry(handle, entry)
+        finally:
+            self._release_archive()
+        if cache:
+            self._cache(entry, contents)
+        return contents
 
     def getfile(self, relative_path):
-        contents = None
-        with self.ix.searcher() as searcher:
-            query = QueryParser('filepath', self.schema).parse(relative_path)
-            results = searcher.search(query)
-            archive = self._open_archive()
-            for result in results:
-                file_path = result['filepath']
-                with archive.open(file_path) as file:
-                    try:
-                        contents = file.readlines()
-                        # list(map(lambda bstr: bstr.decode("utf-8", errors='ignore').replace('\r\n', '\n'),
-                        #     file.readlines()))
-                    except Exception as error:
-                        print(file_path)
-            if not self._hold_mode:
-                self._close_archive()
+        return self.splitLines(self.get_bytes(relative_path))
 
-        if contents is None:
-            raise FileNotFoundError(f"Index search result not found in {self.archive_path}")
-        return contents
+    def entries(self):
+        for entry in self.index:
+            yield entry.name, entry.mtime
+
+    def close(self):
+        super().close()
+        if self.index is not None:
+            self.index.close()
 
 
 if __name__ == "__main__":
@@ -188,8 +733,7 @@ if __name__ == "__main__":
         # seeker = FolderSeeker(game_folder)
         seeker = ArchivesSeeker(game_folder, "data.pak")
         seeker.hold()
-        # seeker = IndexedArchiveSeeker(game_folder, './../indexdir', Schema(filepath=ID(stored=True),
-        #                                                                    zipfile_name=ID(stored=True)))
+        # seeker = IndexedArchiveSeeker(game_folder, "data.pak", './../indexdir')
 
         summ = 0
         repeats = 10
@@ -1,13 +1,27 @@
+import asyncio
+import fnmatch
+import json
 import os
-import shutil
+import re
+import threading
 from src.scripts.file_seeker import *
+from src.scripts.content_cache import ContentCache
+from src.scripts.inflate_cache import InflateCache
+from src.scripts.overlay_catalog import OverlayCatalog, CatalogSourceIndex
+from src.scripts.progress import Progress
+from src.scripts.overlay_watcher import OverlayWatcher
+from src.scripts.seeker_stats import SeekerStats, instrumented
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from hashlib import md5
+from typing import NamedTuple
 from xml.etree import ElementTree as ET
 
 # Default storage of indexed files
 # todo: make it users environment variable
 #
-default_indexed_places = "../index/index.db"
+default_catalog = "../index/catalog.sqlite"
+default_inflate_cache = "../index/inflated"
 
 
 def filehash(file_path):
@@ -23,6 +37,29 @@ def filehash(file_path):
         raise FileNotFoundError(f"{file_path} is not a file")
 
 
+def indexArchive(place):
+    # Entries of the archive central directory, to be stored in the catalog.
+    # Runs in indexing worker processes
+    return readArchive(place)
+
+
+def runIndexing(places, workers=None):
+    # Read central directories of archives, one archive per worker process.
+    # Yields (place, entries, error) triples as soon as archives are read
+    if workers == 1 or len(places) <= 1:
+        for place in places:
+            try:
+                yield place, indexArchive(place), None
+            except Exception as error:
+                yield place, None, error
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(indexArchive, place): place for place in places}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error is not None else future.result(), error
+
+
 # Creating action instance according to its reference File.xdb#xpointer(/Type)
 def classInstanceByXpointerType(xpointer):
     if "#n:inline" in xpointer:
@@ -43,10 +80,10 @@ def fileReferenceByXpointerType(context, xpointer):
     def makeAbsolute(context, ref):
         ref = ref.replace('\\', '/')
         if not ref.startswith('/'):
-            if not self.context.startswith('/'):
-                ref = '/' + os.path.join(self.context, ref)
+            if not context.startswith('/'):
+                ref = '/' + os.path.join(context, ref)
             else:
-                ref = os.path.join(self.context, ref)
+                ref = os.path.join(context, ref)
         return ref.replace('\\', '/')
 
     file_ref = xpointer.split("#xpointer")[0].replace("\\", "/")
@@ -55,6 +92,114 @@ def fileReferenceByXpointerType(context, xpointer):
     return file_ref
 
 
+def fileReferences(root: ET.Element, context):
+    # Files referred by hrefs of the parsed tree (inline objects included) to objects of other
+    # files, i.e. files following bricks are read from. Texts and icons hrefs are only paths
+    references = []
+    for element in root.iter():
+        href = element.get('href')
+        if href is not None and '#xpointer' in href:
+            references.append(fileReferenceByXpointerType(context, href))
+    return list(dict.fromkeys(references))
+
+
+# Resolved last version of a game file: the seeker providing it, the file name
+# inside that source, its modification time and the source fingerprint
+# (archive hash or folder path)
+#
+class OverlayEntry(NamedTuple):
+    seeker: SimpleSeeker
+    name: str
+    mtime: float
+    source: str
+
+
+# Path matching several files when case is ignored
+#
+class AmbiguousPathError(LookupError):
+
+    def __init__(self, rel_path, candidates):
+        super().__init__(f"Path '{rel_path}' is ambiguous, it matches: {', '.join(candidates)}")
+        self.rel_path = rel_path
+        self.candidates = candidates
+
+
+def casefoldPath(relative_path):
+    return formatToArchivePath(relative_path).casefold()
+
+
+def pickVersions(versions, ranks):
+    # Winning versions of a path among (relative path, place, name, mtime) versions offered by
+    # sources, the path is matched ignoring its case as the game does. The source with the latest
+    # version wins, on equal times the earlier source (lower rank) is kept. All spellings of the
+    # path in the winning source are returned, several ones make the path ambiguous
+    if len(versions) == 1:
+        return versions
+    latest = {}
+    for _, place, _, mtime in versions:
+        if place not in latest or mtime > latest[place]:
+            latest[place] = mtime
+    winner = min(latest.keys(), key=lambda place: (-latest[place], ranks[place]))
+    return [version for version in versions if version[1] == winner]
+
+
+# Directory tree of resolved paths as {directory path: (subdirectory names, file names)},
+# the root directory is ''. Directories are kept while there are files under them
+#
+def addToDirectoryTree(tree, rel_path):
+    directory, _, name = rel_path.rpartition('/')
+    kind = 1
+    while True:
+        node = tree.get(directory)
+        created = node is None
+        if created:
+            node = tree[directory] = (set(), set())
+        node[kind].add(name)
+        if not created or not directory:
+            return
+        directory, _, name = directory.rpartition('/')
+        kind = 0
+
+
+def removeFromDirectoryTree(tree, rel_path):
+    directory, _, name = rel_path.rpartition('/')
+    kind = 1
+    while True:
+        node = tree.get(directory)
+        if node is None:
+            return
+        node[kind].discard(name)
+        if node[0] or node[1] or not directory:
+            return
+        del tree[directory]
+        directory, _, name = directory.rpartition('/')
+        kind = 0
+
+
+def joinPath(directory, name):
+    return directory + '/' + name if directory else name
+
+
+def folderSpellings(root, rel_path):
+    # Relative paths of files under 'root' matching 'rel_path' ignoring case, path parts are
+    # matched against listings of their directories
+    parts = [part.casefold() for part in rel_path.split('/') if part]
+    spellings = [''] if parts else []
+    for position, part in enumerate(parts):
+        last = position == len(parts) - 1
+        matched = []
+        for directory in spellings:
+            try:
+                with os.scandir(os.path.join(root, directory)) as entries:
+                    for entry in entries:
+                        if entry.name.casefold() == part and (entry.is_file() if last else entry.is_dir()):
+                            matched.append(joinPath(directory, entry.name))
+            except OSError:
+                continue
+        spellings = matched
+    return spellings
+
+
 class HeroesVFileInspector:
     _instance = None
 
@@ -77,8 +222,6 @@ class HeroesVFileInspector:
         # ("UserCampaigns", ".h5c"),
     ]
 
-    indexes_dir = '../../index/indexes/'
-
     tables = {
         "artifacts": {'ids': {}, 'server_ptr': '7b059128'},
         "creatures": {'ids': {}, 'server_ptr': 'dd04dd1e'},
@@ -88,103 +231,166 @@ class HeroesVFileInspector:
         "talkbox_close_modes": {'ids': {}, 'server_ptr': '10000006'},
     }
 
-    def __init__(self, game_root, indexed_places_file=default_indexed_places, hold_mode=False):
+    def __init__(self, game_root, catalog_file=default_catalog, hold_mode=False,
+                 max_open_archives=16, cache_budget=64 * 1024 * 1024, watch=False,
+                 thread_safe=False, read_workers=None, instrument=False, lazy=False, index_workers=None,
+                 inflate_cache_dir=default_inflate_cache, inflate_cache_budget=512 * 1024 * 1024,
+                 tree_cache_budget=32 * 1024 * 1024):
+        if getattr(self, 'ready', None) is not None:
+            # The single inspector is initialised again: its previous watcher, executors, catalog
+            # and opened files are released first, once its startup is over
+            self.ready.exception()
+            self.close()
         self.game_root = game_root
         if not self.__isHeroesV():
             raise NotADirectoryError("Current directory is not a Heroes V game folder!")
-        self.__hold_mode = hold_mode
+        # Thread safe inspector may be read from any threads: each thread opens archives
+        # on its own and tables are locked while changed. Its bulk reads are inflated
+        # by up to 'read_workers' threads (all CPUs by default)
+        self.thread_safe = thread_safe
+        self.__lock = threading.RLock() if thread_safe else nullcontext()
+        self.read_workers = (read_workers or os.cpu_count() or 1) if thread_safe else 1
+        self.__read_executor = None
+        self.__prefetch_executor = None
+        # Async reads run by up to 'read_workers' threads, pending ones by their paths
+        self.__async_executor = None
+        self.__async_lock = threading.Lock()
+        self.__async_reads = {}
+        # Opened archives are shared by all seekers. In hold mode none of them is closed
+        pool_type = ThreadArchiveHandlePool if thread_safe else ArchiveHandlePool
+        self.archive_pool = pool_type(None if hold_mode else max_open_archives)
+        # Files contents of last resolved versions, within 'cache_budget' bytes
+        self.content_cache = ContentCache(cache_budget, thread_safe)
+        # Parsed trees of last resolved versions, see parse(). Trees are accounted by their estimated
+        # in-memory sizes, see tree_node_size
+        self.tree_cache = ContentCache(tree_cache_budget, thread_safe)
+        # Inflated archive entries kept on disk between runs, unless 'inflate_cache_dir' is None
+        self.inflate_cache = None if inflate_cache_dir is None else InflateCache(inflate_cache_dir,
+                                                                                 inflate_cache_budget)
         self.__used_seekers = {}
+        self.__fingerprints = {}
+        self.__sources_signature = None
         self.unindexed_places = []
-        self.indexes_dictionary = {}
-        self.indexed_places_file = indexed_places_file
-        self.__readIndexes()
-        # Find not indexed (but possible to) places
-        for folder, extension in self.inspected_archives:
-            inspected_folder = os.path.join(self.game_root, folder)
-            if os.path.exists(inspected_folder):
-                for any_file in os.listdir(inspected_folder):
-                    file_abs_path = os.path.join(inspected_folder, any_file)
-                    if any_file.endswith(extension):
-                        file_hash = filehash(file_abs_path)
-                        index = self.__getIndex(file_hash)
-                        if index is None:
-                            print(f"> Not indexed place: {any_file} | {file_hash}")
-                            self.unindexed_places.append(file_abs_path)
-
-    def __getIndex(self, hashsum):
-        if hashsum in self.indexes_dictionary.keys():
-            return self.indexes_dictionary[hashsum]
-        else:
-            return None
+        # Indexed archives with their fingerprints, priorities and entries
+        self.catalog = OverlayCatalog(catalog_file)
+        self.resolution_table = {}
+        # Resolved paths by their casefolded form, as hrefs are written for a case-insensitive filesystem.
+        # Paths are spelled the way the winning source does, several spellings make the path ambiguous
+        self.casefold_table = {}
+        # All spellings of paths spelled differently by different sources, see __resolveOne()
+        self.__spellings = {}
+        # Directory tree of resolved paths, see listdir(), glob() and walk()
+        self.directory_table = {'': (set(), set())}
+        self.watcher = None
+        # Counters and latencies of the inspector and its seekers, see enableStats()
+        self.instrumentation = None
+        if instrument:
+            self.enableStats()
+        # Resolved once the resolution table is built, see onReady()
+        self.ready = Future()
+        # (source, seeker) pairs files are looked up in directly until the inspector is ready
+        self.__direct_seekers = None
+        self.__direct_pool = None
+        # Entry names of directly read archives by their casefolded form, built on their first lookup
+        self.__direct_names = {}
+        self.__starting = lazy
+        if lazy:
+            # Sources are validated and indexed in background, the inspector returns at once
+            self.__direct_seekers = []
+            self.__direct_pool = ArchiveHandlePool(max_open_archives)
+            threading.Thread(target=self.__startLazily, args=(watch, index_workers),
+                             name='InspectorStartup', daemon=True).start()
+            return
+        self.refresh()
+        if watch:
+            self.startWatching()
+        self.ready.set_result(self)
+
+    def __startLazily(self, watch, index_workers):
+        try:
+            catalogued = self.catalog.sources()
+            self.unindexed_places = [file_abs_path for _, _, file_abs_path, file_hash in self.__listSources()
+                                     if catalogued.get(file_abs_path, (None, None))[1] != file_hash]
+            if self.unindexed_places:
+                for _ in self.__indexNewPlaces(index_workers):
+                    pass
+            self.refresh(force=True)
+            if watch:
+                self.startWatching()
+        except BaseException as error:
+            print("<ERROR> Inspector failed to start, files are looked up directly!")
+            print("<ERROR:", error, ">")
+            self.ready.set_exception(error)
+            return
+        self.__starting = False
+        self.ready.set_result(self)
+
+    def onReady(self, callback):
+        # Call 'callback(inspector)' once the inspector is ready (at once, if it's ready already).
+        # It's called from the startup thread, so UI callbacks should be queued to the UI thread
+        self.ready.add_done_callback(lambda future: future.exception() is None and callback(self))
+
+    def isReady(self):
+        return self.ready.done() and self.ready.exception() is None
+
+    def __indexNewPlaces(self, workers=None):
+        places = list(dict.fromkeys(self.unindexed_places))
+        print(f"> Indexing: {places}")
 
-    def __readIndexes(self):
-        # Read existing indexes dictionary from file
-        if os.path.exists(self.indexed_places_file):
-            with open(self.indexed_places_file) as ind:
+        # Central directories are read by worker processes and stored in the catalog here.
+        # Entries of a changed archive are updated in place, by its path
+        priorities = {file_abs_path: priority for priority, (_, _, file_abs_path, _) in enumerate(self.__listSources())}
+        hashes = {}
+        for place in places:
+            hashes[place] = filehash(place)
+            print(f"> Hash: {hashes[place]}")
+
+        yield Progress(0, len(places), 'Indexing')
+        for passed, (place, entries, error) in enumerate(runIndexing(places, workers), 1):
+            if error is None:
                 try:
-                    for line in ind:
-                        hashsum, index = line.replace('\r', '').replace('\n', '').split(' ')
-                        self.indexes_dictionary[hashsum] = index
-                except Exception as error:
-                    print("<ERROR> Unknown error while parsing indexes database")
-                    print("<ERROR", error, ">")
-        else:
-            # Create empty one for write
-            dirs, filename = os.path.split(self.indexed_places_file)
-            os.makedirs(dirs, exist_ok=True)
-            with open(self.indexed_places_file, 'w'):
-                pass
-
-    def __indexNewPlaces(self):
-        print(f"> Indexing: {self.unindexed_places}")
-        for place in self.unindexed_places:
-            # Index dir name is idexed file hash
-            hashsum = filehash(place)
-            print(f"> Hash: {hashsum}")
-            index_dir = self.indexes_dir + str(hashsum)
-            # Flushing possibly existing indexes
-            if os.path.exists(index_dir):
-                shutil.rmtree(index_dir)
-            os.makedirs(index_dir, exist_ok=True)
-            # Create index object in created dir
-            ix = create_in(index_dir, schema=Schema(filepath=ID(stored=True), mtime=ID(stored=True)))
-            self.indexes_dictionary[hashsum] = index_dir
-            writer = ix.writer()
-            with zipfile.ZipFile(place, 'r') as archive:
-                for fileinfo in archive.infolist():
-                    fn = fileinfo.filename
-                    try:
-                        mtime = datetime(*fileinfo.date_time).timestamp()
-                        writer.add_document(filepath=fn, mtime=str(mtime))
-                    except Exception as error:
-                        print(f"<ERROR> Uknown error while processing '{fn}'!")
-                        print("<ERROR:", error, ">")
-
-            print(f"> Created index for {place}...")
-            writer.commit()
-
-        self.__writeIndexes()
-
-    def __writeIndexes(self):
-        with open(self.indexed_places_file, 'w') as indexes_file:
-            for key, value in self.indexes_dictionary.items():
-                string = str(key) + ' ' + str(value) + '\r'
-                indexes_file.write(string)
-        # print(self.indexes_dictionary)
-
-    def __flush(self):
-        # Find unknown indexes
-        # Remove unknown indexes
-        for dir in os.listdir(self.indexes_dir):
-            to_del = True
-            for index_dir in self.indexes_dictionary.values():
-                if dir in index_dir:
-                    to_del = False
-            if to_del:
-                print(f"> Flushing unused index place: {dir}...")
-                shutil.rmtree(os.path.join(self.indexes_dir, dir))
+                    result = self.catalog.updateSource(place, hashes[place], priorities.get(place, len(priorities)),
+                                                       entries)
+                except Exception as catalog_error:
+                    error = catalog_error
+            if error is None:
+                if self.instrumentation is not None:
+                    self.instrumentation.count(self.sourceName(), 'archives_indexed' if result is None
+                                               else 'archives_reindexed')
+                if result is None:
+                    print(f"> Created index for {place}...")
+                else:
+                    added, removed, changed = result
+                    print(f"> Updated index for {place}: "
+                          f"{len(added)} added, {len(removed)} removed, {len(changed)} changed")
+            else:
+                print(f"<ERROR> Failed to index '{place}'!")
+                print("<ERROR:", error, ">")
+            yield Progress(passed, len(places), 'Indexing')
+
+    def __release(self):
+        # Release archives and seekers, so that their files may be replaced or removed
+        #
+        self.archive_pool.clear()
         for used_seeker in self.__used_seekers.values():
-            used_seeker.free()
+            used_seeker.close()
+        self.__used_seekers = {}
+
+    def __syncCatalog(self, priorities):
+        # Removed archives are dropped from the catalog, the rest get priorities of their current order.
+        # The catalog may be shared by several game roots, archives of other roots are kept
+        catalogued = self.catalog.sources()
+        folders = {os.path.join(self.game_root, folder) for folder, _ in self.inspected_archives}
+        removed = [path for path in catalogued.keys()
+                   if path not in priorities and os.path.dirname(path) in folders]
+        if removed:
+            print(f"> Flushing removed places: {removed}")
+            self.catalog.removeSources(removed)
+        moved = {path: priority for path, priority in priorities.items()
+                 if path in catalogued and catalogued[path][2] != priority}
+        if moved:
+            self.catalog.setPriorities(moved)
+        return self.catalog.sources()
 
     # Simple check whether chosen folder is Heroes V game folder
     #
@@ -194,70 +400,785 @@ class HeroesVFileInspector:
                 return True
         return False
 
-    def get(self, rel_path):
+    # Current overlay sources (possibly indexed archives) as
+    # (folder, archive name, archive absolute path, archive hash) quadruples
+    #
+    def __listSources(self):
+        sources = []
+        for folder, extension in self.inspected_archives:
+            inspected_folder = os.path.join(self.game_root, folder)
+            if os.path.exists(inspected_folder):
+                for any_file in sorted(os.listdir(inspected_folder)):
+                    if any_file.endswith(extension):
+                        file_abs_path = os.path.join(inspected_folder, any_file)
+                        sources.append((inspected_folder, any_file, file_abs_path, filehash(file_abs_path)))
+        return sources
 
-        # print(f"Searching for {rel_path} in {self.game_root}")
-        rel_path = rel_path.replace('\\', '/')
-        if rel_path.startswith('/'):
-            rel_path = rel_path.replace('/', '', 1)
+    # Resolve every file of the game overlay (loose folders and all archives) once:
+    # each normalized relative path is mapped to the source holding its last version
+    #
+    def __buildResolutionTable(self, sources):
+        seekers = {}
+        fingerprints = {}
+        unindexed_places = []
 
-        # Get last version of 'rel_path' for installed game
-        #
-        seeker = None
-        final_seeker = None
-        contents = []
-        last_modification_time = 0.0
+        for folder in self.inspected_folders:
+            inspected_folder = os.path.join(self.game_root, folder)
+            if os.path.exists(inspected_folder):
+                seekers[inspected_folder] = FolderSeeker(inspected_folder)
+                fingerprints[inspected_folder] = inspected_folder
+
+        catalogued = self.__syncCatalog({file_abs_path: priority
+                                         for priority, (_, _, file_abs_path, _) in enumerate(sources)})
+        indexed = {}
+        for inspected_folder, any_file, file_abs_path, file_hash in sources:
+            source_id, fingerprint, _ = catalogued.get(file_abs_path, (None, None, None))
+            if fingerprint != file_hash:
+                print(f"> Not indexed place: {any_file} | {file_hash}")
+                seeker = ArchivesSeeker(inspected_folder, any_file, self.archive_pool)
+                unindexed_places.append(file_abs_path)
+            else:
+                seeker = IndexedArchiveSeeker(inspected_folder, any_file, CatalogSourceIndex(self.catalog, source_id),
+                                              self.archive_pool)
+                indexed[source_id] = file_abs_path
+            seekers[file_abs_path] = seeker
+            fingerprints[file_abs_path] = file_hash
+
+        for seeker in seekers.values():
+            seeker.setInstrumentation(self.instrumentation)
+            if isinstance(seeker, ArchivesSeeker):
+                seeker.setInflateCache(self.inflate_cache)
+
+        # Pooled handles of changed archives may be left open on their previous files,
+        # they're closed before sources are scanned
+        for place, source in self.__fingerprints.items():
+            if fingerprints.get(place) != source:
+                self.archive_pool.discard(place)
+
+        # The latest modified version wins whatever case the path is spelled in, see pickVersions().
+        # Loose files and unindexed archives are scanned, winners among indexed archives
+        # are taken from the catalog at once
+        ranks = {place: rank for rank, place in enumerate(seekers.keys())}
+        offered = {}
+
+        def offer(rel_path, place, name, mtime):
+            offered.setdefault(rel_path.casefold(), []).append((rel_path, place, name, mtime))
+
+        for place, seeker in seekers.items():
+            if not isinstance(seeker, IndexedArchiveSeeker):
+                for name, mtime in seeker.entries():
+                    # Inspected archives lying in loose folders are sources, not game files
+                    if isinstance(seeker, FolderSeeker) and self.__archivePlace(os.path.join(place, name)):
+                        continue
+                    offer(formatToArchivePath(name), place, name, mtime)
+        if indexed:
+            for rel_path, name, mtime, source_id in self.catalog.winners(indexed.keys()):
+                offer(rel_path, indexed[source_id], name, mtime)
+
+        table = {}
+        casefold_table = {}
+        directory_table = {'': (set(), set())}
+        spellings = {}
+        for key, versions in offered.items():
+            if len(versions) > 1 and len({rel_path for rel_path, _, _, _ in versions}) > 1:
+                spellings[key] = {rel_path for rel_path, _, _, _ in versions}
+            winners = pickVersions(versions, ranks)
+            for rel_path, place, name, mtime in winners:
+                table[rel_path] = OverlayEntry(seekers[place], name, mtime, fingerprints[place])
+                addToDirectoryTree(directory_table, rel_path)
+            casefold_table[key] = [rel_path for rel_path, _, _, _ in winners]
 
+        # Cached contents of changed or removed archives are dropped. Loose files
+        # aren't fingerprinted, so their contents are dropped on every rebuild
+        for place, source in self.__fingerprints.items():
+            if fingerprints.get(place) != source or isinstance(seekers.get(place), FolderSeeker):
+                self.content_cache.invalidate(source)
+                self.tree_cache.invalidate(source)
+
+        self.__used_seekers = seekers
+        self.__fingerprints = fingerprints
+        self.unindexed_places = unindexed_places
+        self.resolution_table = table
+        self.casefold_table = casefold_table
+        self.directory_table = directory_table
+        self.__spellings = spellings
+
+    def refresh(self, force=False):
+        # Rebuild the resolution table only when the set of sources has changed
+        with self.__lock:
+            sources = self.__listSources()
+            signature = tuple((file_abs_path, file_hash) for _, _, file_abs_path, file_hash in sources)
+            if force or signature != self.__sources_signature:
+                self.__buildResolutionTable(sources)
+                self.__sources_signature = signature
+        return self
+
+    def startWatching(self):
+        # Watch overlay folders (Linux only), so that changes are applied as they happen
+        # instead of rescanning sources. Loose folders are watched recursively
+        if self.watcher is not None:
+            return
+        folders = {}
+        for folder, _ in self.inspected_archives:
+            folders[os.path.join(self.game_root, folder)] = False
         for folder in self.inspected_folders:
-            inspected_fodler = os.path.join(self.game_root, folder)
-            if os.path.exists(inspected_fodler):
-                seeker = FolderSeeker(inspected_fodler)
-                time = seeker.getmtime(rel_path)
-                if time > last_modification_time:
-                    final_seeker = seeker
-                    last_modification_time = time
+            folders[os.path.join(self.game_root, folder)] = True
+        try:
+            self.watcher = OverlayWatcher(folders)
+        except OSError as error:
+            print("<ERROR> Overlay folders can't be watched!")
+            print("<ERROR:", error, ">")
+
+    def stopWatching(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+
+    def __archivePlace(self, path):
+        for folder, extension in self.inspected_archives:
+            if path.endswith(extension) and os.path.dirname(path) == os.path.join(self.game_root, folder):
+                return True
+        return False
+
+    def __applyChanges(self):
+        # Changed archives are reopened and the table is rebuilt if sources are changed,
+        # changed loose files are resolved one by one
+        with self.__lock:
+            changes = self.watcher.changes()
+            if changes:
+                self.__applyChangesList(changes)
 
+    def __applyChangesList(self, changes):
+        rebuild = False
+        archives = set()
+        loose_files = set()
+        for change in changes:
+            if change is None:
+                rebuild = True
+                continue
+            path, is_directory = change
+            if self.__archivePlace(path):
+                archives.add(path)
+            elif is_directory:
+                rebuild = True
+            else:
+                loose_files.add(path)
+
+        for archive in archives:
+            self.archive_pool.discard(archive)
+        if rebuild or archives:
+            self.refresh(force=rebuild)
+            if rebuild:
+                return
+
+        for path in loose_files:
+            for folder in self.inspected_folders:
+                inspected_folder = os.path.join(self.game_root, folder)
+                if path.startswith(os.path.join(inspected_folder, '')):
+                    rel_path = formatToArchivePath(os.path.relpath(path, inspected_folder))
+                    self.content_cache.discard((rel_path, inspected_folder))
+                    self.tree_cache.discard((rel_path, inspected_folder))
+                    self.__resolveOne(rel_path)
+
+    def __resolveOne(self, rel_path):
+        # Resolve a single path the way the whole table is built. Sources are asked for all
+        # known spellings of the path, as the changed file may override or uncover another one
+        key = rel_path.casefold()
+        spellings = {rel_path, *self.casefold_table.get(key, ()), *self.__spellings.get(key, ())}
+        ranks = {place: rank for rank, place in enumerate(self.__used_seekers.keys())}
+        versions = []
+        for place, seeker in self.__used_seekers.items():
+            for spelling, contained in seeker.contains_many(spellings).items():
+                if contained:
+                    versions.append((spelling, place, spelling, seeker.getmtime(spelling)))
+
+        for previous in self.casefold_table.pop(key, ()):
+            del self.resolution_table[previous]
+            removeFromDirectoryTree(self.directory_table, previous)
+        found = {spelling for spelling, _, _, _ in versions}
+        if len(found) > 1:
+            self.__spellings[key] = found
+        else:
+            self.__spellings.pop(key, None)
+        if versions:
+            winners = pickVersions(versions, ranks)
+            for spelling, place, name, mtime in winners:
+                self.resolution_table[spelling] = OverlayEntry(self.__used_seekers[place], name, mtime,
+                                                               self.__fingerprints[place])
+                addToDirectoryTree(self.directory_table, spelling)
+            self.casefold_table[key] = [spelling for spelling, _, _, _ in winners]
+
+    def __createDirectSeekers(self):
+        seekers = []
+        for folder in self.inspected_folders:
+            inspected_folder = os.path.join(self.game_root, folder)
+            if os.path.exists(inspected_folder):
+                seekers.append((inspected_folder, FolderSeeker(inspected_folder)))
         for folder, extension in self.inspected_archives:
             inspected_folder = os.path.join(self.game_root, folder)
             if os.path.exists(inspected_folder):
-                for any_file in os.listdir(inspected_folder):
-                    file_abs_path = os.path.join(inspected_folder, any_file)
+                for any_file in sorted(os.listdir(inspected_folder)):
                     if any_file.endswith(extension):
-                        file_hash = filehash(file_abs_path)
-                        index = self.__getIndex(file_hash)
-                        seeker = None
-
-                        # In hold mode, archive seekers are saved into inspector memory
-                        if self.__hold_mode:
-                            if file_abs_path in self.__used_seekers.keys():
-                                seeker = self.__used_seekers.get(file_abs_path)
-
-                        # If no seeker was pre-found (not hold mode or first usage either)
-                        if seeker is None:
-                            # If no index for this archive, use default seeker
-                            if index is None:
-                                # print(f"> Unindexed place: {any_file} | {file_hash}")
-                                seeker = ArchivesSeeker(inspected_folder, any_file)
-                                self.unindexed_places.append(file_abs_path)
-                            else:
-                                # print(f"> Indexed place: {any_file} | {file_hash}")
-                                seeker = IndexedArchiveSeeker(inspected_folder, any_file, index)
-                                pass
-                            if self.__hold_mode:
-                                seeker.hold()
-                                self.__used_seekers[file_abs_path] = seeker
-
-                        mtime = seeker.getmtime(rel_path)
-                        if mtime > last_modification_time:
-                            final_seeker = seeker
-
-        if final_seeker is not None:
-            contents = final_seeker.getfile(rel_path)
-        else:
+                        file_abs_path = os.path.join(inspected_folder, any_file)
+                        seekers.append((file_abs_path, ArchivesSeeker(inspected_folder, any_file, self.__direct_pool)))
+        for _, seeker in seekers:
+            seeker.setInstrumentation(self.instrumentation)
+            if isinstance(seeker, ArchivesSeeker):
+                seeker.setInflateCache(self.inflate_cache)
+        return seekers
+
+    def __directSpellings(self, source, seeker, rel_path):
+        # Spellings of the path in a single source, matched ignoring case
+        if isinstance(seeker, FolderSeeker):
+            return [spelling for spelling in folderSpellings(seeker.root, rel_path)
+                    if not self.__archivePlace(os.path.join(seeker.root, spelling))]
+        names = self.__direct_names.get(source)
+        if names is None:
+            names = {}
+            for name, _ in seeker.entries():
+                names.setdefault(casefoldPath(name), []).append(name)
+            self.__direct_names[source] = names
+        return names.get(rel_path.casefold(), [])
+
+    def __directResolve(self, rel_path):
+        # Until the resolution table is built, every source is asked for the file ignoring
+        # its case. Versions are picked the way the table is built and resolve() looks these up
+        with self.__lock:
+            if not self.__direct_seekers:
+                self.__direct_seekers = self.__createDirectSeekers()
+            seekers = self.__direct_seekers
+        if self.instrumentation is not None:
+            self.instrumentation.count(self.sourceName(), 'direct_lookups')
+        rel_path = formatToArchivePath(rel_path)
+        ranks = {source: rank for rank, (source, _) in enumerate(seekers)}
+        versions = []
+        for source, seeker in seekers:
+            for spelling in self.__directSpellings(source, seeker, rel_path):
+                mtime = seeker.getmtime(spelling)
+                if mtime > 0.0:
+                    versions.append((spelling, source, spelling, mtime))
+        if not versions:
             raise FileNotFoundError(f"Inspector didn't find any file '{rel_path}'")
+        winners = pickVersions(versions, ranks)
+        exact = [version for version in winners if version[0] == rel_path]
+        if exact:
+            winners = exact
+        elif len(winners) > 1:
+            raise AmbiguousPathError(rel_path, sorted(spelling for spelling, _, _, _ in winners))
+        spelling, source, name, mtime = winners[0]
+        return OverlayEntry(dict(seekers)[source], name, mtime, source)
+
+    def __releaseDirectSeekers(self):
+        with self.__lock:
+            if self.__direct_seekers is not None:
+                # Contents read directly are cached by archive paths instead of hashes
+                for source, seeker in self.__direct_seekers:
+                    seeker.close()
+                    if isinstance(seeker, ArchivesSeeker):
+                        self.content_cache.invalidate(source)
+                        self.tree_cache.invalidate(source)
+                self.__direct_pool.clear()
+                self.__direct_seekers = None
+                self.__direct_names = {}
+
+    def resolve(self, rel_path):
+        if self.__direct_seekers is not None:
+            if self.__starting:
+                return self.__directResolve(rel_path)
+            self.__releaseDirectSeekers()
+        if self.watcher is not None:
+            self.__applyChanges()
+        resolved = self.resolution_table.get(formatToArchivePath(rel_path))
+        if resolved is None:
+            # Exact path is missing, the path is looked up ignoring its case
+            candidates = self.casefold_table.get(casefoldPath(rel_path))
+            if self.instrumentation is not None:
+                self.instrumentation.count(self.sourceName(), 'casefold_lookups')
+            if candidates is None:
+                if self.instrumentation is not None:
+                    self.instrumentation.count(self.sourceName(), 'missing_files')
+                raise FileNotFoundError(f"Inspector didn't find any file '{rel_path}'")
+            if len(candidates) > 1:
+                raise AmbiguousPathError(rel_path, sorted(candidates))
+            resolved = self.resolution_table[candidates[0]]
+        return resolved
+
+    def __directory(self, directory):
+        # (path, subdirectory names, file names) of the resolved directory, or None. Path parts
+        # are matched ignoring their case, the way files are resolved, so directories spelled
+        # in several cases (by different sources) are listed as one. Each part of its path is
+        # spelled as requested if such a spelling exists; subdirectories are named by their
+        # first spellings
+        if self.__starting:
+            # Listing needs the whole overlay resolved
+            self.ready.result()
+        if self.watcher is not None:
+            self.__applyChanges()
+        with self.__lock:
+            paths = ['']
+            spelled = ''
+            for part in filter(None, directory.split('/')):
+                names = {name for path in paths for name in self.directory_table[path][0]
+                         if name.casefold() == part.casefold()}
+                if not names:
+                    return None
+                paths = [joinPath(path, name) for path in paths for name in names
+                         if name in self.directory_table[path][0]]
+                spelled = joinPath(spelled, part if part in names else min(names))
+            directories = {}
+            files = set()
+            for path in paths:
+                subdirectories, path_files = self.directory_table[path]
+                for name in subdirectories:
+                    directories.setdefault(name.casefold(), set()).add(name)
+                files |= path_files
+            return spelled, {min(names) for names in directories.values()}, files
+
+    def listdir(self, rel_path=''):
+        # Sorted names of subdirectories and files of the overlay directory 'rel_path'
+        listed = self.__directory(formatToArchivePath(rel_path))
+        if listed is None:
+            raise FileNotFoundError(f"Inspector didn't find any directory '{rel_path}'")
+        _, directories, files = listed
+        return sorted(directories | files)
+
+    def walk(self, rel_path=''):
+        # Yields (directory path, subdirectory names, file names) of the overlay directory
+        # 'rel_path' and all directories under it, top-down. Like os.walk(), removing
+        # subdirectory names from the yielded list prunes these directories
+        listed = self.__directory(formatToArchivePath(rel_path))
+        if listed is None:
+            return
+        pending = [listed]
+        while pending:
+            directory, directories, files = pending.pop()
+            directories = sorted(directories)
+            yield directory, directories, sorted(files)
+            for name in reversed(directories):
+                listed = self.__directory(joinPath(directory, name))
+                if listed is not None:
+                    pending.append(listed)
 
+    def glob(self, pattern):
+        # Sorted relative paths of overlay files matching 'pattern', ignoring case like
+        # resolve() does. Path parts are fnmatch patterns, '**' matches any number of
+        # directories (all files under the directory, if it's the last part). Literal
+        # parts are looked up directly, so only matching directories are visited
+        parts = [part for part in formatToArchivePath(pattern).split('/') if part]
+        matched = set()
+        if parts:
+            self.__glob('', parts, matched)
+        return sorted(matched)
+
+    def __glob(self, directory, parts, matched):
+        listed = self.__directory(directory)
+        if listed is None:
+            return
+        directory, directories, files = listed
+        part, rest = parts[0], parts[1:]
+        if part == '**':
+            if rest:
+                self.__glob(directory, rest, matched)
+            else:
+                matched.update(joinPath(directory, name) for name in files)
+            for name in directories:
+                self.__glob(joinPath(directory, name), parts, matched)
+            return
+        if any(char in part for char in '*?['):
+            expression = re.compile(fnmatch.translate(part), re.IGNORECASE)
+            names = directories if rest else files
+            names = [name for name in names if expression.match(name)]
+        else:
+            names = [part]
+        for name in names:
+            if rest:
+                self.__glob(joinPath(directory, name), rest, matched)
+            elif name in files:
+                matched.add(joinPath(directory, name))
+            else:
+                candidates = [file for file in files if file.casefold() == name.casefold()]
+                if len(candidates) == 1:
+                    matched.add(joinPath(directory, candidates[0]))
+
+    def __read(self, resolved: OverlayEntry):
+        # Contents are cached by the resolved file, whatever case it was requested in
+        key = (resolved.name, resolved.source)
+        contents = self.content_cache.get(key)
+        if contents is None:
+            contents = resolved.seeker.get_bytes(resolved.name)
+            self.content_cache.put(key, contents, len(contents))
+            self.__countRead(resolved.seeker)
         return contents
 
+    def __countRead(self, seeker, files=1):
+        # Archives are read through their entries indexes or, until these are created, through zipfile
+        if self.instrumentation is not None:
+            if isinstance(seeker, IndexedArchiveSeeker):
+                self.instrumentation.count(self.sourceName(), 'indexed_reads', files)
+            elif isinstance(seeker, ArchivesSeeker):
+                self.instrumentation.count(self.sourceName(), 'fallback_reads', files)
+            else:
+                self.instrumentation.count(self.sourceName(), 'loose_reads', files)
+
+    @instrumented('get_bytes')
+    def get_bytes(self, rel_path):
+        return self.__read(self.resolve(rel_path))
+
+    @instrumented('get_view')
+    def get_view(self, rel_path):
+        # Cached contents are viewed in place. Loose files and stored archive entries
+        # are viewed through memory mapping, so only inflated contents get cached
+        resolved = self.resolve(rel_path)
+        contents = self.content_cache.get((resolved.name, resolved.source))
+        if contents is not None:
+            return memoryview(contents)
+        view = resolved.seeker.get_view(resolved.name)
+        if isinstance(view.obj, bytes):
+            self.content_cache.put((resolved.name, resolved.source), view.obj, view.nbytes)
+        return view
+
+    @instrumented('open_stream')
+    def open_stream(self, rel_path):
+        resolved = self.resolve(rel_path)
+        contents = self.content_cache.get((resolved.name, resolved.source))
+        if contents is not None:
+            return io.BytesIO(contents)
+        return resolved.seeker.open_stream(resolved.name)
+
+    @instrumented('get')
+    def get(self, rel_path):
+        # Get last version of 'rel_path' for installed game
+        #
+        resolved = self.resolve(rel_path)
+        return resolved.seeker.splitLines(self.__read(resolved))
+
+    def iter_many(self, rel_paths):
+        # Yields (relative path, lines) pairs for all 'rel_paths'. All paths are resolved
+        # before anything is read; cached files come first, the rest is read source by source
+        # in on-disk order, so that archives are read sequentially
+        #
+        for resolved, contents, requested_paths in self.__iterContents(rel_paths):
+            lines = resolved.seeker.splitLines(contents)
+            for requested_path in requested_paths:
+                yield requested_path, lines
+
+    def iter_bytes_many(self, rel_paths, cache=True):
+        # Yields (relative path, contents) pairs for all 'rel_paths', read the way iter_many() does.
+        # One-off scans of many files read these with 'cache' False, so that neither the content
+        # cache nor the inflate cache is filled with them
+        for _, contents, requested_paths in self.__iterContents(rel_paths, cache):
+            for requested_path in requested_paths:
+                yield requested_path, contents
+
+    def __iterContents(self, rel_paths, cache=True):
+        # Yields (resolved, contents, requested paths) of every resolved file
+        requested = {}
+        for rel_path in rel_paths:
+            requested.setdefault(self.resolve(rel_path), []).append(rel_path)
+
+        groups = {}
+        for resolved, requested_paths in requested.items():
+            contents = self.content_cache.get((resolved.name, resolved.source))
+            if contents is None:
+                groups.setdefault(resolved.seeker, {})[resolved.name] = resolved
+                continue
+            yield resolved, contents, requested_paths
+
+        for resolved, contents in self.__readGroups(groups, cache):
+            yield resolved, contents, requested[resolved]
+
+    def __readGroups(self, groups, cache=True):
+        # Yields (resolved, contents) of files grouped as {seeker: {name: resolved}}, source by
+        # source in on-disk order. Read contents are cached, unless 'cache' is False
+        order = {seeker: position for position, seeker in enumerate(self.__used_seekers.values())}
+        for seeker in sorted(groups.keys(), key=lambda seeker: order.get(seeker, len(order))):
+            names = groups[seeker]
+            for name, contents in self.__readGroup(seeker, list(names.keys()), cache):
+                resolved = names[name]
+                if cache:
+                    self.content_cache.put((name, resolved.source), contents, len(contents))
+                self.__countRead(seeker)
+                yield resolved, contents
+
+    def __readGroup(self, seeker, names, cache=True):
+        # Files of a single source in on-disk order. With several read workers the ordered
+        # files are split into contiguous runs, each one read and inflated by its own worker
+        if self.read_workers <= 1 or len(names) < 2 * self.read_workers:
+            yield from seeker.get_bytes_many(names, cache)
+            return
+        offsets = seeker.getoffset_many(names)
+        ordered = sorted(offsets.keys(), key=offsets.get)
+        run_length = -(-len(ordered) // self.read_workers)
+        runs = [ordered[start:start + run_length] for start in range(0, len(ordered), run_length)]
+        for files in self.__readExecutor().map(lambda run: list(seeker.get_bytes_many(run, cache)), runs):
+            yield from files
+
+    def prefetch(self, rel_paths):
+        # Read files into the content cache ahead of their use, e.g. files referred by a parsed
+        # brick before its children are created. Thread safe inspector reads them in background
+        # by the prefetching thread, so reading overlaps parsing; others read them at once,
+        # in archives order. Missing files are skipped, these fail once they are really read
+        rel_paths = list(rel_paths)
+        if not rel_paths:
+            return
+        if not self.thread_safe:
+            self.__prefetchNow(rel_paths)
+            return
+        with self.__lock:
+            if self.__prefetch_executor is None:
+                self.__prefetch_executor = ThreadPoolExecutor(1, thread_name_prefix='InspectorPrefetch')
+            self.__prefetch_executor.submit(self.__prefetchNow, rel_paths)
+
+    def __prefetchNow(self, rel_paths):
+        groups = {}
+        try:
+            for rel_path in rel_paths:
+                try:
+                    resolved = self.resolve(rel_path)
+                except (OSError, LookupError):
+                    continue
+                if (resolved.name, resolved.source) not in self.content_cache:
+                    groups.setdefault(resolved.seeker, {})[resolved.name] = resolved
+            prefetched = sum(1 for _ in self.__readGroups(groups))
+            if self.instrumentation is not None:
+                self.instrumentation.count(self.sourceName(), 'prefetched_files', prefetched)
+        except Exception as error:
+            print("<ERROR> Failed to prefetch files!")
+            print("<ERROR:", error, ">")
+
+    def __readExecutor(self):
+        with self.__lock:
+            if self.__read_executor is None:
+                self.__read_executor = ThreadPoolExecutor(self.read_workers, thread_name_prefix='InspectorReader')
+            return self.__read_executor
+
+    def sourceName(self):
+        return 'inspector'
+
+    def enableStats(self):
+        if self.instrumentation is None:
+            self.instrumentation = SeekerStats()
+            self.instrumentation.register(self.sourceName(), type(self).__name__)
+            for seeker in self.__used_seekers.values():
+                seeker.setInstrumentation(self.instrumentation)
+
+    def disableStats(self):
+        self.instrumentation = None
+        for seeker in self.__used_seekers.values():
+            seeker.setInstrumentation(None)
+
+    def stats(self):
+        # Counters and latency histograms of the inspector and all sources, along with
+        # the content, parsed trees and inflate caches and opened archives pool state
+        return {
+            'enabled': self.instrumentation is not None,
+            'sources': {} if self.instrumentation is None else self.instrumentation.stats(),
+            'cache': self.content_cache.stats(),
+            'tree_cache': self.tree_cache.stats(),
+            'inflate_cache': None if self.inflate_cache is None else self.inflate_cache.stats(),
+            'pool': self.archive_pool.stats(),
+        }
+
+    def dumpStats(self, path):
+        with open(path, 'w') as stats_file:
+            json.dump(self.stats(), stats_file, indent=2)
+
+    def close(self):
+        # Stop watching, reading, prefetching and async workers and release all opened files
+        self.stopWatching()
+        self.__releaseDirectSeekers()
+        with self.__lock:
+            if self.__prefetch_executor is not None:
+                self.__prefetch_executor.shutdown(cancel_futures=True)
+                self.__prefetch_executor = None
+            if self.__async_executor is not None:
+                self.__async_executor.shutdown()
+                self.__async_executor = None
+            if self.__read_executor is not None:
+                self.__read_executor.shutdown()
+                self.__read_executor = None
+            self.__release()
+            self.catalog.close()
+
+    @instrumented('get_many')
+    def get_many(self, rel_paths):
+        # Last versions of all 'rel_paths' as {relative path: lines}, read the way iter_many() does
+        return dict(self.iter_many(rel_paths))
+
+    # Estimated memory taken by a parsed element along with its tag, attributes and text (in bytes),
+    # parsed trees are about ten times bigger than their files
+    tree_node_size = 300
+
+    @instrumented('parse')
+    def parse(self, rel_path, chunk_size=64 * 1024):
+        # Root element of the parsed file. Trees are parsed once per file version and shared
+        # by all callers, so these must be treated as read-only (copy.deepcopy() them to modify)
+        #
+        resolved = self.resolve(rel_path)
+        key = (resolved.name, resolved.source)
+        root = self.tree_cache.get(key)
+        if root is not None:
+            return root
+        parser = ET.XMLParser()
+        with self.open_stream(rel_path) as stream:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+        root = parser.close()
+        self.tree_cache.put(key, root, sum(1 for _ in root.iter()) * self.tree_node_size)
+        return root
+
+    def iterparse(self, rel_path, tags, chunk_size=64 * 1024):
+        # Parses the file while it's being read, yielding complete elements matching any of 'tags'.
+        # Plain tag is matched anywhere, path ('Parent/Tag') - from the document root.
+        # Consumed elements are dropped from the tree, so only the current subtree is kept in memory
+        #
+        names = {tag for tag in tags if '/' not in tag.strip('/')}
+        paths = {tag.strip('/') for tag in tags if '/' in tag.strip('/')}
+
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        opened = []  # (element, path from root, is matched) of currently opened elements
+        matched_opened = 0
+
+        with self.open_stream(rel_path) as stream:
+            while True:
+                chunk = stream.read(chunk_size)
+                if chunk:
+                    parser.feed(chunk)
+                else:
+                    parser.close()
+
+                for event, element in parser.read_events():
+                    if event == 'start':
+                        # Document root isn't a part of the path
+                        if not opened:
+                            path = ''
+                        elif not opened[-1][1]:
+                            path = element.tag
+                        else:
+                            path = opened[-1][1] + '/' + element.tag
+                        is_matched = element.tag in names or path in paths
+                        opened.append((element, path, is_matched))
+                        matched_opened += is_matched
+                        continue
+
+                    _, _, is_matched = opened.pop()
+                    if is_matched:
+                        matched_opened -= 1
+                        yield element
+                    # Subtrees of opened matched elements are kept until these are yielded
+                    if matched_opened == 0 and opened:
+                        parent = opened[-1][0]
+                        if len(parent) and parent[-1] is element:
+                            del parent[-1]
+                        element.clear()
+
+                if not chunk:
+                    break
+
+    # Asyncio API. Reads are run by a bounded executor: up to 'read_workers' threads of
+    # a thread safe inspector, a single thread otherwise (so an inspector which isn't thread
+    # safe mustn't be read synchronously while async reads are pending). Concurrent awaits
+    # of the same path share a single read, cancelled awaits don't cancel it
+    #
+    async_batch_size = 256
+
+    def __asyncExecutor(self):
+        with self.__lock:
+            if self.__async_executor is None:
+                self.__async_executor = ThreadPoolExecutor(self.read_workers, thread_name_prefix='InspectorAsync')
+            return self.__async_executor
+
+    def __asyncReads(self, rel_paths):
+        # {relative path: Future of (resolved, contents)}, pending reads of the same paths are joined.
+        # Paths are matched as spelled: paths in other cases may resolve to other files or be ambiguous
+        futures = {}
+        started = []
+        with self.__async_lock:
+            for rel_path in rel_paths:
+                key = formatToArchivePath(rel_path)
+                future = self.__async_reads.get(key)
+                if future is None:
+                    future = self.__async_reads[key] = Future()
+                    future.add_done_callback(lambda done, key=key: self.__forgetAsyncRead(key, done))
+                    started.append((rel_path, future))
+                elif self.instrumentation is not None:
+                    self.instrumentation.count(self.sourceName(), 'coalesced_reads')
+                futures[rel_path] = future
+
+        for start in range(0, len(started), self.async_batch_size):
+            batch = dict(started[start:start + self.async_batch_size])
+            try:
+                self.__asyncExecutor().submit(self.__readBatch, batch)
+            except RuntimeError as error:
+                # Inspector is closed
+                for future in batch.values():
+                    future.set_exception(error)
+        return futures
+
+    def __forgetAsyncRead(self, key, done):
+        with self.__async_lock:
+            if self.__async_reads.get(key) is done:
+                del self.__async_reads[key]
+
+    def __readBatch(self, futures):
+        # Resolve and read files of {relative path: Future} the way iter_many() does,
+        # failures of single files are set to their futures
+        groups = {}
+        requested = {}
+        for rel_path, future in futures.items():
+            try:
+                resolved = self.resolve(rel_path)
+            except Exception as error:
+                future.set_exception(error)
+                continue
+            contents = self.content_cache.get((resolved.name, resolved.source))
+            if contents is not None:
+                future.set_result((resolved, contents))
+                continue
+            groups.setdefault(resolved.seeker, {})[resolved.name] = resolved
+            requested.setdefault(resolved, []).append(future)
+        try:
+            for resolved, contents in self.__readGroups(groups):
+                for future in requested.pop(resolved):
+                    future.set_result((resolved, contents))
+        except Exception as error:
+            for pending in requested.values():
+                for future in pending:
+                    future.set_exception(error)
+
+    @staticmethod
+    async def __lines(future):
+        resolved, contents = await asyncio.shield(asyncio.wrap_future(future))
+        return resolved.seeker.splitLines(contents)
+
+    async def aget(self, rel_path):
+        # Async get()
+        return await self.__lines(self.__asyncReads([rel_path])[rel_path])
+
+    async def aget_many(self, rel_paths):
+        # Async get_many(), files are read in batches in archives order
+        futures = self.__asyncReads(rel_paths)
+        lines = await asyncio.gather(*(self.__lines(future) for future in futures.values()))
+        return dict(zip(futures.keys(), lines))
+
+    async def aiterparse(self, rel_path, tags, chunk_size=64 * 1024):
+        # Async iterparse(). Elements are parsed by the executor one by one, as these
+        # are dropped from the tree once the next one is requested
+        loop = asyncio.get_running_loop()
+        executor = self.__asyncExecutor()
+        elements = self.iterparse(rel_path, tags, chunk_size)
+        try:
+            while True:
+                element = await loop.run_in_executor(executor, next, elements, None)
+                if element is None:
+                    break
+                yield element
+        finally:
+            await loop.run_in_executor(executor, elements.close)
+
     def getNumericID(self, table, string_id):
         if table not in self.tables.keys():
             raise AttributeError(1, f"Invalid table name {table}")
@@ -268,24 +1189,31 @@ class HeroesVFileInspector:
 
     def updateTypes(self):
 
-        contents = self.get("types.xml")
-        document_root = ET.fromstringlist(contents)
+        server_ptrs = {table_props['server_ptr']: table_name for table_name, table_props in self.tables.items()}
 
-        for item in document_root.findall("SharedClasses/Item"):
-            server_ptr = item.find("__ServerPtr").text
+        for item in self.iterparse("types.xml", tags=("SharedClasses/Item",)):
+            table_name = server_ptrs.pop(item.find("__ServerPtr").text, None)
+            if table_name is not None:
+                for entry in item.findall("Entries/Item"):
+                    STRING_ID = entry.find("Name").text
+                    numeric_id = entry.find("Value").text
+                    self.tables[table_name]['ids'][STRING_ID] = numeric_id
+            # Rest of types is skipped once all tables are filled
+            if not server_ptrs:
+                break
 
-            for table_name, table_props in self.tables.items():
-                if server_ptr == table_props['server_ptr']:
-                    for entry in item.findall("Entries/Item"):
-                        STRING_ID = entry.find("Name").text
-                        numeric_id = entry.find("Value").text
-                        self.tables[table_name]['ids'][STRING_ID] = numeric_id
+    def iterUpdateIndexes(self, workers=None):
+        # Index unindexed places using up to 'workers' processes (all CPUs by default),
+        # yielding indexing progress. Files can't be read until indexes are updated
+        try:
+            yield from self.__indexNewPlaces(workers)
+        finally:
+            with self.__lock:
+                self.refresh(force=True)
 
-    def updateIndexes(self):
-        self.__readIndexes()
-        self.__indexNewPlaces()
-        self.__writeIndexes()
-        self.__flush()
+    def updateIndexes(self, workers=None):
+        for _ in self.iterUpdateIndexes(workers):
+            pass
 
 
 if __name__ == "__main__":
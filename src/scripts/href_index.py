@@ -0,0 +1,136 @@
+import os
+import posixpath
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from xml.etree import ElementTree as ET
+from src.scripts.file_seeker import formatToArchivePath
+from src.scripts.heroes_v_file_seeker import HeroesVFileInspector, fileReferenceByXpointerType
+from src.scripts.progress import Progress
+
+
+def parseHrefs(rel_path, contents):
+    # Targets of all hrefs and XPointer elements of the file (references to inline objects
+    # excluded) as relative paths, the way the inspector resolves them. Runs in parsing worker processes
+    root = ET.fromstring(contents)
+    context = posixpath.dirname(rel_path)
+    targets = set()
+    for element in root.iter():
+        href = element.get('href')
+        if href is None and element.tag == 'XPointer' and element.text is not None:
+            href = element.text.strip()
+        if href is None or not href.split('#', 1)[0].strip():
+            continue
+        targets.add(formatToArchivePath(posixpath.normpath(fileReferenceByXpointerType(context, href))))
+    return sorted(targets)
+
+
+def parseBatch(files):
+    # (relative path, targets, error) of (relative path, contents) pairs
+    results = []
+    for rel_path, contents in files:
+        try:
+            results.append((rel_path, parseHrefs(rel_path, contents), None))
+        except Exception as error:
+            results.append((rel_path, [], str(error)))
+    return results
+
+
+def runParsing(batches, workers=None):
+    # Parse batches of files, one batch per worker process. Batches are taken as workers
+    # are free, so only a few of them are kept in memory. Yields results of parsed batches
+    if workers == 1:
+        for files in batches:
+            yield parseBatch(files)
+        return
+    in_flight = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        for files in batches:
+            pending.add(executor.submit(parseBatch, files))
+            if len(pending) >= in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+class HrefIndex:
+    # Forward and reverse href dependencies of all game files of the overlay: which files
+    # each file refers to and which files refer to it. Files are parsed in parallel and
+    # their hrefs are stored in the inspector catalog along with the parsed versions,
+    # so only changed files are parsed again. Queries are dictionary lookups
+    #
+    extensions = ('.xdb',)
+    batch_size = 64
+
+    def __init__(self, inspector: HeroesVFileInspector):
+        self.inspector = inspector
+        self.forward = {}
+        self.reverse = {}
+        self.__load()
+
+    def __load(self):
+        forward = {}
+        reverse = {}
+        for path, target in self.inspector.catalog.hrefs():
+            forward.setdefault(path, set()).add(target)
+            reverse.setdefault(target, set()).add(path)
+        self.forward = {path: frozenset(targets) for path, targets in forward.items()}
+        self.reverse = {target: frozenset(paths) for target, paths in reverse.items()}
+
+    def __resolveTarget(self, target):
+        # Hrefs are written for a case-insensitive filesystem, targets are stored the way
+        # files are resolved. Missing targets are kept as written
+        if target in self.inspector.resolution_table:
+            return target
+        candidates = self.inspector.casefold_table.get(target.casefold())
+        if candidates is not None and len(candidates) == 1:
+            return candidates[0]
+        return target
+
+    def iterUpdate(self, workers=None):
+        # Parse changed and new files using up to 'workers' processes (all CPUs by default),
+        # yielding parsing progress
+        inspector = self.inspector
+        inspector.ready.result()
+        # Loose files are changed without changing the sources signature
+        inspector.refresh(force=True)
+        files = {rel_path: resolved for rel_path, resolved in inspector.resolution_table.items()
+                 if rel_path.casefold().endswith(self.extensions)}
+        parsed = inspector.catalog.parsedFiles()
+        stale = sorted(rel_path for rel_path, resolved in files.items()
+                       if parsed.get(rel_path) != (resolved.source, resolved.mtime))
+        removed = [rel_path for rel_path in parsed.keys() if rel_path not in files]
+        print(f"> Parsing hrefs: {len(stale)} changed files, {len(removed)} removed files")
+
+        def batches():
+            for start in range(0, len(stale), self.batch_size):
+                # Scanned files would evict the working set of the inspector caches
+                yield list(inspector.iter_bytes_many(stale[start:start + self.batch_size], cache=False))
+
+        results = {}
+        yield Progress(0, len(stale), 'Parsing')
+        for batch in runParsing(batches(), 1 if len(stale) <= self.batch_size else workers):
+            for rel_path, targets, error in batch:
+                if error is not None:
+                    print(f"<ERROR> Failed to parse '{rel_path}'!")
+                    print("<ERROR:", error, ">")
+                resolved = files[rel_path]
+                results[rel_path] = (resolved.source, resolved.mtime,
+                                     {self.__resolveTarget(target) for target in targets})
+            yield Progress(len(results), len(stale), 'Parsing')
+
+        inspector.catalog.updateHrefs(results, removed)
+        self.__load()
+
+    def update(self, workers=None):
+        for _ in self.iterUpdate(workers):
+            pass
+
+    def references(self, rel_path):
+        # Files the file refers to
+        return self.forward.get(self.__resolveTarget(formatToArchivePath(rel_path)), frozenset())
+
+    def referrers(self, rel_path):
+        # Files referring to the file
+        return self.reverse.get(self.__resolveTarget(formatToArchivePath(rel_path)), frozenset())
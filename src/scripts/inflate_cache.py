@@ -0,0 +1,160 @@
+import mmap
+import os
+import threading
+import time
+import zipfile
+import zlib
+
+
+class InflateCache:
+    # On-disk cache of inflated archive entries, shared by runs and game roots. Entries are
+    # addressed by their contents (CRC-32, compressed and uncompressed sizes), so the same
+    # entry of any archive is inflated once. Files are written atomically and read through
+    # memory mapping. Least recently used files are removed once the cache exceeds its
+    # budget (in bytes). Use times are file modification times, refreshed on reads.
+    # Cached files are checked against entries CRC-32 when these are loaded, as the cache
+    # is shared by game roots and lives outside of them: damaged files are inflated again
+    #
+    # Smaller entries are inflated faster than their cached files are opened
+    min_size = 4 * 1024
+    # Cache is trimmed down to this part of the budget, so it isn't trimmed on every write
+    trim_ratio = 0.9
+    # Use times are refreshed at most this often (in seconds)
+    touch_interval = 60 * 60
+
+    def __init__(self, directory, budget=512 * 1024 * 1024):
+        self.directory = directory
+        self.budget = budget
+        os.makedirs(directory, exist_ok=True)
+        self.__lock = threading.Lock()
+        # Size of cached files, counted once the first file is written
+        self.__size = None
+
+    def accepts(self, entry):
+        # Entry (ArchiveEntry or zipfile.ZipInfo) is worth caching
+        return entry.compress_type != zipfile.ZIP_STORED and self.min_size <= entry.file_size <= self.budget
+
+    def path(self, entry):
+        crc = f'{entry.CRC:08x}'
+        return os.path.join(self.directory, crc[:2], f'{crc}-{entry.compress_size}-{entry.file_size}')
+
+    def __map(self, entry):
+        path = self.path(entry)
+        try:
+            with open(path, 'rb') as cached_file:
+                info = os.fstat(cached_file.fileno())
+                if info.st_size != entry.file_size:
+                    # Left by a crashed writer of another version, it's rewritten
+                    return None
+                mapped = mmap.mmap(cached_file.fileno(), 0, access=mmap.ACCESS_READ) if entry.file_size else None
+        except OSError:
+            return None
+        if zlib.crc32(mapped if mapped is not None else b'') != entry.CRC:
+            if mapped is not None:
+                mapped.close()
+            self.__remove(path, info.st_size)
+            return None
+        if time.time() - info.st_mtime > self.touch_interval:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return mapped
+
+    def __remove(self, path, size):
+        print(f"<ERROR> Cached inflated file '{path}' is damaged, it's inflated again!")
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self.__lock:
+            if self.__size is not None:
+                self.__size -= size
+
+    def get(self, entry):
+        # Inflated contents of the entry, or None if these aren't cached
+        mapped = self.__map(entry)
+        if mapped is None:
+            return None
+        with mapped:
+            return mapped[:]
+
+    def view(self, entry):
+        # Inflated contents of the entry viewed in place, or None if these aren't cached
+        mapped = self.__map(entry)
+        if mapped is None:
+            return None
+        return memoryview(mapped)
+
+    def put(self, entry, contents):
+        if not self.accepts(entry):
+            return
+        path = self.path(entry)
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            existed = os.path.exists(path)
+            with open(temporary_path, 'wb') as cached_file:
+                cached_file.write(contents)
+            os.replace(temporary_path, path)
+        except OSError as error:
+            print(f"<ERROR> Failed to cache inflated '{getattr(entry, 'name', getattr(entry, 'filename', ''))}'!")
+            print("<ERROR:", error, ">")
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            return
+        with self.__lock:
+            if self.__size is None:
+                self.__size = sum(size for _, size, _ in self.__files())
+            elif not existed:
+                self.__size += len(contents)
+            trim = self.__size > self.budget
+        if trim:
+            self.trim()
+
+    def __files(self):
+        # (use time, size, path) of all cached files
+        files = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for cached in os.scandir(shard.path):
+                if cached.name.endswith('.tmp'):
+                    continue
+                try:
+                    info = cached.stat()
+                except OSError:
+                    continue
+                files.append((info.st_mtime, info.st_size, cached.path))
+        return files
+
+    def trim(self, budget=None):
+        # Remove least recently used files until the cache fits 'budget' (a part of the cache budget).
+        # Files are counted again, as they may be written by other processes
+        budget = self.budget * self.trim_ratio if budget is None else budget
+        with self.__lock:
+            files = sorted(self.__files())
+            size = sum(size for _, size, _ in files)
+            for _, file_size, path in files:
+                if size <= budget:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Mapped by this or another process
+                    continue
+                size -= file_size
+            self.__size = size
+
+    def clear(self):
+        self.trim(0)
+
+    def stats(self):
+        files = self.__files()
+        return {
+            'files': len(files),
+            'size': sum(size for _, size, _ in files),
+            'budget': self.budget,
+        }
@@ -104,10 +104,9 @@ class TypesRefTablesParser:
 
         def getItems(self) -> set[TypesRefTablesParser.ReferencedObject]:
 
-            xdb_table = ET.fromstringlist(self.inspector.get(self.db_path))
             items = set()
 
-            for item in xdb_table.findall('objects/Item'):
+            for item in self.inspector.iterparse(self.db_path, tags=('objects/Item',)):
 
                 if item.find('ID') is None and item.find('obj') is None and item.find(Obj) is None:
                     raise ParseError(f"Invalid object in table '{self.db_path}'")
@@ -122,6 +121,12 @@ class TypesRefTablesParser:
 
             if len(items) != len(self.UIDs):
                 raise ParseError(f"Several object ID were missed for table '{self.db_path}'", self.db_path)
+
+            # Referenced files are read at once, in their archives order
+            referencing = [item for item in items if item.getReference() is not None]
+            contents = self.inspector.get_many(item.getReference() for item in referencing)
+            for item in referencing:
+                item.contents = contents[item.getReference()]
             return items
 
     # A simple instance which describes unique object correlated with UID in reference table
@@ -131,12 +136,20 @@ class TypesRefTablesParser:
             self.inspector = inspector
             self.id = id
             self.object = objectInfo
+            # Referenced file lines, if these were read in advance
+            self.contents = None
 
-        def getContents(self):
+        def getReference(self):
             if 'href' in self.object.keys():
-                href = self.object.get('href')
-                file_ref = fileReferenceByXpointerType('/', href)
-                return self.inspector.get(file_ref)
+                return fileReferenceByXpointerType('/', self.object.get('href'))
+            return None
+
+        def getContents(self):
+            file_ref = self.getReference()
+            if file_ref is not None:
+                if self.contents is None:
+                    self.contents = self.inspector.get(file_ref)
+                return self.contents
             else:
                 return ET.tostringlist(self.object)
 
@@ -163,10 +176,7 @@ class TypesRefTablesParser:
 
         if self.getInspector() is None:
             raise ParseError("Heroes V File Inspector not provided! Use .setInspector")
-        TypesXMLContents = self.inspector.get('types.xml')
-        TypesXML = ET.fromstringlist(TypesXMLContents)
-
-        for table_item in TypesXML.findall("Tables/Item"):
+        for table_item in self.inspector.iterparse('types.xml', tags=("Tables/Item",)):
 
             ReferenceTable = None
             LuaRefTableContents = None
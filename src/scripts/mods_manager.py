@@ -1,6 +1,5 @@
 import tempfile
 import xml.etree.ElementTree
-from dataclasses import dataclass
 import queue
 import requests
 import os
@@ -12,20 +11,7 @@ from zipfile import ZipFile, BadZipfile
 from xml.etree import ElementTree as ET
 from typing import Optional, Dict
 from hashlib import sha256
-
-
-# As will be used below, a return value that is indicating artificial internal
-# progress of any task
-@dataclass
-class Progress:
-    passed: int
-    total: int
-    desc: str = 'Work'
-
-    def percent(self):
-        if self.total == 0:
-            return 100.0
-        return round(self.passed / self.total * 100, 2)
+from src.scripts.progress import Progress
 
 
 def filehash(filepath):
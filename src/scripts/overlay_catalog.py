@@ -0,0 +1,242 @@
+import os
+import sqlite3
+import threading
+from src.scripts.file_seeker import ArchiveEntry, formatToArchivePath
+
+
+class OverlayCatalog:
+    # Persistent SQLite catalog of game sources (archives) and their entries.
+    # Sources are stored with their fingerprints (archive hashes) and overlay priorities
+    # (listing order, the lower one wins on equal modification times), entries - with
+    # everything needed to read them straight from their local headers. So the winning
+    # version of any path (or of all paths under a prefix) is a single query, and archives
+    # that aren't changed since the last run are never scanned again.
+    # Hrefs of parsed game files are stored along with the resolved version (source
+    # fingerprint and modification time) they were parsed from, see HrefIndex
+    #
+    # Version 2: hrefs include targets of XPointer elements
+    version = 2
+    schema = '''
+        CREATE TABLE IF NOT EXISTS sources (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            fingerprint TEXT NOT NULL,
+            priority INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS entries (
+            path TEXT NOT NULL,
+            source INTEGER NOT NULL REFERENCES sources (id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            header_offset INTEGER NOT NULL,
+            compress_size INTEGER NOT NULL,
+            file_size INTEGER NOT NULL,
+            compress_type INTEGER NOT NULL,
+            crc INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            PRIMARY KEY (path, source)
+        ) WITHOUT ROWID;
+        CREATE UNIQUE INDEX IF NOT EXISTS entries_by_source ON entries (source, name);
+        CREATE TABLE IF NOT EXISTS parsed_files (
+            path TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            mtime REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS hrefs (
+            path TEXT NOT NULL REFERENCES parsed_files (path) ON DELETE CASCADE,
+            target TEXT NOT NULL,
+            PRIMARY KEY (path, target)
+        ) WITHOUT ROWID;
+    '''
+    entry_columns = 'name, header_offset, compress_size, file_size, compress_type, crc, mtime'
+    # Names per query of bulk lookups, SQLite limits query parameters
+    chunk_size = 500
+
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        directory = os.path.dirname(catalog_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__lock = threading.RLock()
+        self.__connection = sqlite3.connect(catalog_path, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode = WAL')
+        self.__connection.execute('PRAGMA foreign_keys = ON')
+        version = self.__connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.version:
+            # Catalogs of other versions are rebuilt from scratch
+            self.__connection.executescript('DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS sources; '
+                                            'DROP TABLE IF EXISTS hrefs; DROP TABLE IF EXISTS parsed_files;')
+            self.__connection.execute(f'PRAGMA user_version = {self.version}')
+        self.__connection.executescript(self.schema)
+        self.__connection.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    def sources(self):
+        # Catalogued sources as {path: (id, fingerprint, priority)}
+        with self.__lock:
+            rows = self.__connection.execute('SELECT path, id, fingerprint, priority FROM sources').fetchall()
+        return {path: (source_id, fingerprint, priority) for path, source_id, fingerprint, priority in rows}
+
+    def updateSource(self, path, fingerprint, priority, entries):
+        # Store the source with all its entries. Entries of the known source are updated
+        # in place: only added, removed and changed ones are written. Entries are changed when
+        # their contents are (CRC or sizes), entries only moved by others (offsets and times)
+        # are updated in place and aren't reported.
+        # Returns (added, removed, changed) entry names for the known source, None for the new one
+        entries = {entry.name: entry for entry in entries}
+        with self.__lock, self.__connection:
+            known = self.__connection.execute('SELECT id FROM sources WHERE path = ?', (path,)).fetchone()
+            if known is None:
+                source_id = self.__connection.execute(
+                    'INSERT INTO sources (path, fingerprint, priority) VALUES (?, ?, ?)',
+                    (path, fingerprint, priority)).lastrowid
+                self.__insert(source_id, entries.values())
+                return None
+
+            source_id = known[0]
+            previous = {entry.name: entry for entry in self.__entries(source_id)}
+            added = {name for name in entries.keys() if name not in previous}
+            removed = {name for name in previous.keys() if name not in entries}
+            changed = {name for name in entries.keys()
+                       if name in previous and self.__contents(previous[name]) != self.__contents(entries[name])}
+            moved = [entries[name] for name in entries.keys()
+                     if name in previous and name not in changed and previous[name] != entries[name]]
+            self.__connection.executemany('DELETE FROM entries WHERE source = ? AND name = ?',
+                                          [(source_id, name) for name in removed | changed])
+            self.__insert(source_id, [entries[name] for name in added | changed])
+            self.__connection.executemany(
+                'UPDATE entries SET header_offset = ?, mtime = ? WHERE source = ? AND name = ?',
+                [(entry.header_offset, entry.mtime, source_id, entry.name) for entry in moved])
+            self.__connection.execute('UPDATE sources SET fingerprint = ?, priority = ? WHERE id = ?',
+                                      (fingerprint, priority, source_id))
+            return added, removed, changed
+
+    @staticmethod
+    def __contents(entry: ArchiveEntry):
+        return entry.CRC, entry.file_size, entry.compress_size, entry.compress_type
+
+    def __insert(self, source_id, entries):
+        self.__connection.executemany(
+            f'INSERT OR REPLACE INTO entries (path, source, {self.entry_columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(formatToArchivePath(entry.name), source_id, entry.name, entry.header_offset, entry.compress_size,
+              entry.file_size, entry.compress_type, entry.CRC, entry.mtime) for entry in entries])
+
+    def setPriorities(self, priorities):
+        # Priorities of known sources as {path: priority}
+        with self.__lock, self.__connection:
+            self.__connection.executemany('UPDATE sources SET priority = ? WHERE path = ?',
+                                          [(priority, path) for path, priority in priorities.items()])
+
+    def removeSources(self, paths):
+        with self.__lock, self.__connection:
+            self.__connection.executemany('DELETE FROM sources WHERE path = ?', [(path,) for path in paths])
+
+    def __entries(self, source_id):
+        return [ArchiveEntry(*row) for row in self.__connection.execute(
+            f'SELECT {self.entry_columns} FROM entries WHERE source = ? ORDER BY name', (source_id,))]
+
+    def entries(self, source_id):
+        with self.__lock:
+            return self.__entries(source_id)
+
+    def count(self, source_id):
+        with self.__lock:
+            return self.__connection.execute('SELECT COUNT(*) FROM entries WHERE source = ?',
+                                             (source_id,)).fetchone()[0]
+
+    def lookup(self, source_id, name):
+        with self.__lock:
+            row = self.__connection.execute(
+                f'SELECT {self.entry_columns} FROM entries WHERE source = ? AND name = ?',
+                (source_id, name)).fetchone()
+        return None if row is None else ArchiveEntry(*row)
+
+    def lookup_many(self, source_id, names):
+        names = list(set(names))
+        entries = {}
+        with self.__lock:
+            for start in range(0, len(names), self.chunk_size):
+                chunk = names[start:start + self.chunk_size]
+                for row in self.__connection.execute(
+                        f'SELECT {self.entry_columns} FROM entries '
+                        f'WHERE source = ? AND name IN ({", ".join("?" * len(chunk))})', (source_id, *chunk)):
+                    entries[row[0]] = ArchiveEntry(*row)
+        return entries
+
+    def winner(self, path, source_ids):
+        # Winning (path, entry name, mtime, source id) of the path among 'source_ids' sources, or None
+        source_ids = list(source_ids)
+        with self.__lock:
+            return self.__connection.execute(
+                'SELECT entries.path, entries.name, entries.mtime, entries.source '
+                'FROM entries JOIN sources ON sources.id = entries.source '
+                f'WHERE entries.path = ? AND entries.source IN ({", ".join("?" * len(source_ids))}) '
+                'ORDER BY entries.mtime DESC, sources.priority ASC LIMIT 1',
+                (formatToArchivePath(path), *source_ids)).fetchone()
+
+    def winners(self, source_ids, prefix=''):
+        # Winning (path, entry name, mtime, source id) of every path under 'prefix' among 'source_ids' sources
+        source_ids = list(source_ids)
+        condition = f'entries.source IN ({", ".join("?" * len(source_ids))})'
+        parameters = list(source_ids)
+        if prefix:
+            condition += ' AND entries.path >= ? AND entries.path < ?'
+            prefix = formatToArchivePath(prefix)
+            parameters += [prefix, prefix + '\U0010ffff']
+        with self.__lock:
+            return self.__connection.execute(
+                'SELECT path, name, mtime, source FROM ('
+                '    SELECT entries.path, entries.name, entries.mtime, entries.source, ROW_NUMBER() OVER ('
+                '        PARTITION BY entries.path ORDER BY entries.mtime DESC, sources.priority ASC) AS rank'
+                '    FROM entries JOIN sources ON sources.id = entries.source'
+                f'    WHERE {condition}'
+                ') WHERE rank = 1', parameters).fetchall()
+
+    def parsedFiles(self):
+        # Parsed files as {path: (source fingerprint, mtime)} of their versions
+        with self.__lock:
+            rows = self.__connection.execute('SELECT path, source, mtime FROM parsed_files').fetchall()
+        return {path: (source, mtime) for path, source, mtime in rows}
+
+    def updateHrefs(self, parsed, removed=()):
+        # Store hrefs of parsed files {path: (source fingerprint, mtime, targets)},
+        # replacing the ones of their previous versions, and forget 'removed' files
+        with self.__lock, self.__connection:
+            self.__connection.executemany('DELETE FROM parsed_files WHERE path = ?',
+                                          [(path,) for path in list(removed) + list(parsed.keys())])
+            self.__connection.executemany('INSERT INTO parsed_files (path, source, mtime) VALUES (?, ?, ?)',
+                                          [(path, source, mtime) for path, (source, mtime, _) in parsed.items()])
+            self.__connection.executemany('INSERT OR IGNORE INTO hrefs (path, target) VALUES (?, ?)',
+                                          [(path, target) for path, (_, _, targets) in parsed.items()
+                                           for target in targets])
+
+    def hrefs(self):
+        # All (path, target) hrefs of parsed files
+        with self.__lock:
+            return self.__connection.execute('SELECT path, target FROM hrefs').fetchall()
+
+
+class CatalogSourceIndex:
+    # Entries index of a single catalogued source, for IndexedArchiveSeeker
+    #
+    def __init__(self, catalog: OverlayCatalog, source_id):
+        self.catalog = catalog
+        self.source_id = source_id
+
+    def lookup(self, name):
+        return self.catalog.lookup(self.source_id, name)
+
+    def lookup_many(self, names):
+        return self.catalog.lookup_many(self.source_id, names)
+
+    def __iter__(self):
+        return iter(self.catalog.entries(self.source_id))
+
+    def __len__(self):
+        return self.catalog.count(self.source_id)
+
+    def close(self):
+        # Catalog is shared by all sources and closed by its owner
+        pass
@@ -0,0 +1,143 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+from queue import SimpleQueue
+
+# inotify event masks, see <sys/inotify.h>
+#
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+watched_events = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+                 IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+
+def loadInotify():
+    # Linux C library providing inotify functions, raises OSError elsewhere
+    library = ctypes.util.find_library('c')
+    if library is None:
+        raise OSError("C library is not found")
+    libc = ctypes.CDLL(library, use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError("inotify is not available on this system")
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class OverlayWatcher:
+    # Watches folders of the game overlay with Linux inotify. Changes are read by the
+    # watcher thread and queued as (absolute path, is directory) pairs, None stands for
+    # lost events (queue overflow), after which everything must be treated as changed.
+    # Queued changes are taken by 'changes()' without blocking
+    #
+    event_header = struct.Struct('iIII')
+    read_size = 64 * 1024
+
+    def __init__(self, folders):
+        # 'folders' are {folder path: is recursive} pairs
+        self.__thread = None
+        self.__libc = loadInotify()
+        self.__fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.__fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.__watches = {}
+        self.__changes = SimpleQueue()
+        self.__stop_reader, self.__stop_writer = os.pipe()
+        for folder, recursive in folders.items():
+            if os.path.isdir(folder):
+                self.__watch(folder, recursive)
+        self.__thread = threading.Thread(target=self.__run, name='OverlayWatcher', daemon=True)
+        self.__thread.start()
+
+    def __watch(self, folder, recursive):
+        descriptor = self.__libc.inotify_add_watch(self.__fd, os.fsencode(folder), watched_events)
+        if descriptor < 0:
+            error = ctypes.get_errno()
+            print(f"<ERROR> Failed to watch '{folder}'!")
+            print("<ERROR:", os.strerror(error), ">")
+            return
+        self.__watches[descriptor] = (folder, recursive)
+        if recursive:
+            try:
+                with os.scandir(folder) as directory:
+                    for entry in directory:
+                        if entry.is_dir(follow_symlinks=False):
+                            self.__watch(entry.path, True)
+            except OSError:
+                # Folder is removed meanwhile, its removal is queued anyway
+                pass
+
+    def __run(self):
+        while True:
+            readable, _, _ = select.select([self.__fd, self.__stop_reader], [], [])
+            if self.__stop_reader in readable:
+                break
+            try:
+                data = os.read(self.__fd, self.read_size)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = self.event_header.unpack_from(data, offset)
+                offset += self.event_header.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                self.__event(descriptor, mask, os.fsdecode(name))
+
+    def __event(self, descriptor, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.__changes.put(None)
+            return
+        if mask & IN_IGNORED:
+            self.__watches.pop(descriptor, None)
+            return
+        watched = self.__watches.get(descriptor)
+        if watched is None:
+            return
+        folder, recursive = watched
+        is_directory = bool(mask & IN_ISDIR)
+        # Created files are reported once they are written
+        if mask & IN_CREATE and not is_directory:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            self.__changes.put((folder, True))
+            return
+        path = os.path.join(folder, name)
+        if is_directory and recursive and mask & (IN_CREATE | IN_MOVED_TO):
+            self.__watch(path, True)
+        self.__changes.put((path, is_directory))
+
+    def changes(self):
+        changes = []
+        while not self.__changes.empty():
+            changes.append(self.__changes.get_nowait())
+        return changes
+
+    def close(self):
+        if self.__thread is None:
+            return
+        os.write(self.__stop_writer, b'\0')
+        self.__thread.join()
+        self.__thread = None
+        for descriptor in (self.__fd, self.__stop_reader, self.__stop_writer):
+            os.close(descriptor)
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,15 @@
+from dataclasses import dataclass
+
+
+# As will be used below, a return value that is indicating artificial internal
+# progress of any task
+@dataclass
+class Progress:
+    passed: int
+    total: int
+    desc: str = 'Work'
+
+    def percent(self):
+        if self.total == 0:
+            return 100.0
+        return round(self.passed / self.total * 100, 2)
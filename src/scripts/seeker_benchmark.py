@@ -0,0 +1,230 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from src.scripts import file_seeker
+from src.scripts.file_seeker import FolderSeeker, ArchivesSeeker, IndexedArchiveSeeker, ArchiveHandlePool
+from src.scripts.heroes_v_file_seeker import HeroesVFileInspector, filehash, indexArchive
+from src.scripts.overlay_catalog import OverlayCatalog, CatalogSourceIndex
+
+# Seekers micro-benchmarks on synthetic game roots. Results are printed (or written)
+# as JSON, so that runs of different versions may be compared:
+#   python -m src.scripts.seeker_benchmark --archives 4 --entries 2000 --output results.json
+#
+
+words = ['Item', 'Creature', 'Spell', 'Skill', 'Artifact', 'Hero', 'Town', 'Object', 'Script', 'Text']
+
+
+def syntheticFile(generator: random.Random, size):
+    # XML-like contents, compressed about as well as game files are
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<Object>']
+    length = sum(len(line) + 1 for line in lines)
+    while length < size:
+        word = generator.choice(words)
+        line = f'\t<{word}>{generator.randrange(1_000_000)}</{word}>'
+        lines.append(line)
+        length += len(line) + 1
+    lines.append('</Object>')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def generateGameRoot(root, archives=3, entries=1000, file_size=4096, loose_files=100, seed=0):
+    # Game root of 'archives' .pak files (the last one is a mod .h5u), each holding 'entries' files.
+    # Every next archive overrides a half of files of the previous one, loose files override them all.
+    # Returns relative paths of all files
+    generator = random.Random(seed)
+    for folder in ('bin', 'data', 'UserMODs'):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+    rel_paths = [f'GameMechanics/{generator.choice(words)}/{number:06}.xdb' for number in range(entries)]
+    for number in range(archives):
+        if number == archives - 1 and archives > 1:
+            archive_path = os.path.join(root, 'UserMODs', f'mod{number}.h5u')
+        else:
+            archive_path = os.path.join(root, 'data', f'data{number}.pak')
+        date_time = (2006 + number, 1, 1, 0, 0, 0)
+        overridden = rel_paths if number == 0 else rel_paths[::2]
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for rel_path in overridden:
+                archive.writestr(zipfile.ZipInfo(rel_path, date_time), syntheticFile(generator, file_size),
+                                 zipfile.ZIP_DEFLATED)
+
+    for rel_path in rel_paths[:loose_files]:
+        abs_path = os.path.join(root, 'data', rel_path)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        with open(abs_path, 'wb') as loose_file:
+            loose_file.write(syntheticFile(generator, file_size))
+    return rel_paths
+
+
+def measure(function, repeats, setup=None):
+    # Timings of 'repeats' calls in seconds, 'setup' is called before each call and isn't timed
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        'repeats': repeats,
+        'total': sum(timings),
+        'mean': statistics.mean(timings),
+        'median': statistics.median(timings),
+        'min': min(timings),
+        'max': max(timings),
+    }
+
+
+def benchmarkSeeker(create_seeker, names, repeats, generator: random.Random):
+    # Cold lookups create a new seeker with no shared state, warm ones reuse a single seeker
+    def cold():
+        file_seeker._archive_name_indexes.clear()
+        seeker = create_seeker()
+        if getattr(seeker, 'pool', None) is not None:
+            seeker.pool.clear()
+        seeker.get_bytes(generator.choice(names))
+        seeker.close()
+
+    seeker = create_seeker()
+    results = {
+        'cold': measure(cold, repeats),
+        'warm': measure(lambda: seeker.get_bytes(generator.choice(names)), repeats),
+        'miss': measure(lambda: seeker.contains_many(['Missing/File.xdb']), repeats),
+        'bulk': measure(lambda: sum(1 for _ in seeker.get_bytes_many(names)), max(1, repeats // 100)),
+    }
+    seeker.close()
+    return results
+
+
+def benchmarkInspector(root, rel_paths, repeats, generator: random.Random, work_dir):
+    def miss():
+        try:
+            inspector.get('Missing/File.xdb')
+        except FileNotFoundError:
+            pass
+
+    def drop():
+        # Cold reads inflate entries again: neither contents nor inflated entries are cached
+        inspector.content_cache.clear()
+        inspector.inflate_cache.clear()
+
+    def cold():
+        inspector.get(generator.choice(rel_paths))
+
+    def bulk():
+        inspector.get_many(rel_paths)
+
+    # Inflate cache of a kept work dir would be left warm by previous runs
+    os.makedirs(work_dir, exist_ok=True)
+    inflate_cache_dir = tempfile.mkdtemp(prefix='inflated_', dir=work_dir)
+    startup = time.perf_counter()
+    inspector = HeroesVFileInspector(root, catalog_file=os.path.join(work_dir, 'catalog.sqlite'),
+                                     inflate_cache_dir=inflate_cache_dir)
+    startup = time.perf_counter() - startup
+
+    indexing = time.perf_counter()
+    inspector.updateIndexes()
+    indexing = time.perf_counter() - indexing
+
+    results = {
+        'startup': startup,
+        'indexing': indexing,
+        'cold': measure(cold, repeats, drop),
+        'warm': measure(lambda: inspector.get(generator.choice(rel_paths[:64])), repeats),
+        'miss': measure(miss, repeats),
+        'bulk': measure(bulk, max(1, repeats // 100), drop),
+        'cache': inspector.content_cache.stats(),
+        'pool': inspector.archive_pool.stats(),
+    }
+    inspector.close()
+    shutil.rmtree(inflate_cache_dir, ignore_errors=True)
+    return results
+
+
+def runBenchmarks(archives=3, entries=1000, file_size=4096, loose_files=100, repeats=1000, seed=0, work_dir=None):
+    temporary_dir = work_dir or tempfile.mkdtemp(prefix='seeker_benchmark_')
+    try:
+        root = os.path.join(temporary_dir, 'root')
+        generation = time.perf_counter()
+        rel_paths = generateGameRoot(root, archives, entries, file_size, loose_files, seed)
+        generation = time.perf_counter() - generation
+
+        # Indexed archive is read through the catalog, the way the inspector reads it
+        data_folder = os.path.join(root, 'data')
+        archive_path = os.path.join(data_folder, 'data0.pak')
+        catalog = OverlayCatalog(os.path.join(temporary_dir, 'seeker_index', 'catalog.sqlite'))
+        catalog.updateSource(archive_path, filehash(archive_path), 0, indexArchive(archive_path))
+        source_id = catalog.sources()[archive_path][0]
+
+        generator = random.Random(seed)
+        pool = ArchiveHandlePool()
+        seekers = {
+            'FolderSeeker': (lambda: FolderSeeker(data_folder), rel_paths[:loose_files]),
+            'ArchivesSeeker': (lambda: ArchivesSeeker(data_folder, 'data0.pak', pool), rel_paths),
+            'IndexedArchiveSeeker': (lambda: IndexedArchiveSeeker(data_folder, 'data0.pak',
+                                                                  CatalogSourceIndex(catalog, source_id), pool),
+                                     rel_paths),
+        }
+        results = {name: benchmarkSeeker(create_seeker, names, repeats, generator)
+                   for name, (create_seeker, names) in seekers.items() if names}
+        pool.clear()
+        catalog.close()
+        results['HeroesVFileInspector'] = benchmarkInspector(root, rel_paths, repeats, generator,
+                                                             os.path.join(temporary_dir, 'index'))
+        return {
+            'parameters': {
+                'archives': archives,
+                'entries': entries,
+                'file_size': file_size,
+                'loose_files': loose_files,
+                'repeats': repeats,
+                'seed': seed,
+            },
+            'environment': {
+                'python': sys.version,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'generation': generation,
+            'results': results,
+        }
+    finally:
+        if work_dir is None:
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Heroes V file seekers micro-benchmarks")
+    parser.add_argument('--archives', type=int, default=3, help="number of generated archives")
+    parser.add_argument('--entries', type=int, default=1000, help="files in each archive")
+    parser.add_argument('--file-size', type=int, default=4096, help="approximate size of each file in bytes")
+    parser.add_argument('--loose-files', type=int, default=100, help="files in the loose data folder")
+    parser.add_argument('--repeats', type=int, default=1000, help="measured calls of each benchmark")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', help="keep generated game root in this folder")
+    parser.add_argument('--output', help="write JSON results to the file instead of stdout")
+    options = parser.parse_args(arguments)
+
+    # Progress messages of seekers are kept out of JSON results
+    with contextlib.redirect_stdout(sys.stderr):
+        results = runBenchmarks(options.archives, options.entries, options.file_size, options.loose_files,
+                                options.repeats, options.seed, options.work_dir)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
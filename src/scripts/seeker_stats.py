@@ -0,0 +1,90 @@
+import functools
+import json
+import threading
+import time
+
+
+class SeekerStats:
+    # Opt-in instrumentation of the inspector and its seekers: counters and latency
+    # histograms per source (archive path, folder path or 'inspector') and per operation.
+    # Latency histogram buckets are powers of two of microseconds
+    #
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counters = {}
+        self.__latencies = {}
+        self.__kinds = {}
+
+    def register(self, source, kind):
+        with self.__lock:
+            self.__kinds[source] = kind
+
+    def count(self, source, counter, value=1):
+        with self.__lock:
+            counters = self.__counters.setdefault(source, {})
+            counters[counter] = counters.get(counter, 0) + value
+
+    def observe(self, source, operation, seconds):
+        bucket = int(seconds * 1_000_000).bit_length()
+        with self.__lock:
+            latency = self.__latencies.setdefault(source, {}).get(operation)
+            if latency is None:
+                latency = self.__latencies[source][operation] = {'count': 0, 'total': 0.0, 'max': 0.0, 'buckets': {}}
+            latency['count'] += 1
+            latency['total'] += seconds
+            latency['max'] = max(latency['max'], seconds)
+            latency['buckets'][bucket] = latency['buckets'].get(bucket, 0) + 1
+
+    def reset(self):
+        with self.__lock:
+            self.__counters.clear()
+            self.__latencies.clear()
+
+    def stats(self, source=None):
+        # Snapshot as {source: {'kind', 'counters', 'latency': {operation: summary}}},
+        # of a single source if it's given
+        with self.__lock:
+            sources = set(self.__counters.keys()) | set(self.__latencies.keys())
+            if source is not None:
+                sources &= {source}
+            snapshot = {}
+            for name in sorted(sources):
+                latencies = {}
+                for operation, latency in self.__latencies.get(name, {}).items():
+                    latencies[operation] = {
+                        'count': latency['count'],
+                        'total': latency['total'],
+                        'mean': latency['total'] / latency['count'],
+                        'max': latency['max'],
+                        'histogram': {f'<{1 << bucket}us': hits for bucket, hits in sorted(latency['buckets'].items())},
+                    }
+                snapshot[name] = {
+                    'kind': self.__kinds.get(name),
+                    'counters': dict(self.__counters.get(name, {})),
+                    'latency': latencies,
+                }
+        if source is not None:
+            return snapshot.get(source, {'kind': self.__kinds.get(source), 'counters': {}, 'latency': {}})
+        return snapshot
+
+    def dump(self, path):
+        with open(path, 'w') as stats_file:
+            json.dump(self.stats(), stats_file, indent=2)
+
+
+def instrumented(operation):
+    # Times the method, if its object has instrumentation enabled ('instrumentation' attribute
+    # is not None). Disabled instrumentation costs a single attribute check
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instrumentation = self.instrumentation
+            if instrumentation is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                instrumentation.observe(self.sourceName(), operation, time.perf_counter() - start)
+        return wrapper
+    return decorator
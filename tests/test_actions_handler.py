@@ -0,0 +1,129 @@
+import os
+import sys
+import zipfile
+import pytest
+
+# Scripts of bricks import their neighbours as top level modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'scripts'))
+
+import actions_handler
+from actions_handler import AdvMapBuilding, ScriptGraph
+
+SIGN = '/Scripts/Sign.(ActionShowFlyingSign).xdb#xpointer(/ActionShowFlyingSign)'
+
+
+def flyingSign(on_end=''):
+    return f'<ActionShowFlyingSign><PlayersFilter>ALL</PlayersFilter><Text href="Sign.txt"/>' \
+           f'<Duration>3</Duration><Target/><OnEnd{on_end}/></ActionShowFlyingSign>'
+
+
+def building(name, on_touch):
+    return f'<AdvMapBuilding><Name>{name}</Name><Behaviour><OnTouch href="{on_touch}"/><OnRemove/>' \
+           f'</Behaviour></AdvMapBuilding>'
+
+
+@pytest.fixture
+def inspect(tmp_path):
+    inspectors = []
+
+    def create(files):
+        root = tmp_path / 'game'
+        for folder in ('bin', 'data', 'UserMODs'):
+            os.makedirs(root / folder, exist_ok=True)
+        with zipfile.ZipFile(root / 'data' / 'data.pak', 'w') as archive:
+            for name, contents in files.items():
+                archive.writestr(name, contents)
+        inspector = actions_handler.HeroesVFileInspector(str(root),
+                                                         catalog_file=str(tmp_path / 'index' / 'catalog.sqlite'),
+                                                         inflate_cache_dir=None)
+        inspector.tables = {'players_filter': {'ids': {'ALL': '0'}},
+                            'talkbox_close_modes': {'ids': {'CLOSE': '1'}}}
+        inspectors.append(inspector)
+        return inspector
+
+    yield create
+    for inspector in inspectors:
+        inspector.close()
+
+
+def test_action_shared_by_map_objects(inspect):
+    inspector = inspect({
+        'Scripts/Sign.(ActionShowFlyingSign).xdb': flyingSign(),
+        'Maps/M/Shop.xdb': building('Shop', SIGN),
+        'Maps/M/Mill.xdb': building('Mill', SIGN.replace('/Scripts/Sign', '/scripts/SIGN')),
+    })
+    graph = ScriptGraph()
+    objects = [AdvMapBuilding.fromGameFile(f'/Maps/M/{name}.xdb', inspector, graph) for name in ('Shop', 'Mill')]
+    script = graph.toScript(objects)
+    assert script.count('function Brick_scripts_sign__actionshowflyingsign(hero, player)') == 1
+    assert sum('Brick_scripts_sign__actionshowflyingsign(hero, player)' in line for line in script) == 3
+    assert script.index('end') < [line.strip() for line in script].index('function Shop_onTouch(hero, object)')
+
+
+def sheet(*options):
+    # 'options' as (OnChoose href, FollowingSheet href) pairs, empty ones aren't set
+    def reference(tag, href):
+        return f'<{tag} href="{href}"/>' if href else f'<{tag}/>'
+
+    items = ''.join(f'<Item><BriefDesc>Option</BriefDesc><AnswerText href="Answer.txt"/>'
+                    f'{reference("OnChoose", on_choose)}{reference("FollowingSheet", following)}</Item>'
+                    for on_choose, following in options)
+    return f'<TalkboxSheet><Icon/><CloseMode>CLOSE</CloseMode><Title href="Title.txt"/><Text href="Text.txt"/>' \
+           f'<IconTooltip href=""/><SelectionText href=""/><AdditionalText href=""/>' \
+           f'<OptionsList>{items}</OptionsList></TalkboxSheet>'
+
+
+def dialog(on_end, start_sheet):
+    return f'<ActionShowBranchedDialog><PlayersFilter>ALL</PlayersFilter><BeModal>true</BeModal>' \
+           f'<OnEnd href="{on_end}"/><StartSheet href="{start_sheet}"/></ActionShowBranchedDialog>'
+
+
+def test_recursive_actions(inspect):
+    inspector = inspect({
+        'Scripts/Start.(ActionShowFlyingSign).xdb':
+            flyingSign(' href="A.(ActionShowFlyingSign).xdb#xpointer(/ActionShowFlyingSign)"'),
+        'Scripts/A.(ActionShowFlyingSign).xdb':
+            flyingSign(' href="B.(ActionShowFlyingSign).xdb#xpointer(/ActionShowFlyingSign)"'),
+        'Scripts/B.(ActionShowFlyingSign).xdb':
+            flyingSign(' href="/scripts/a.(ActionShowFlyingSign).xdb#xpointer(/ActionShowFlyingSign)"'),
+    })
+    start = actions_handler.ActionShowFlyingSign.fromGameFile('/Scripts/Start.(ActionShowFlyingSign).xdb', inspector)
+    with pytest.raises(RecursionError) as error:
+        start.toScript()
+    assert error.value.args == (812, "Recursive .(Action) objects referring: "
+                                     "/Scripts/A.(ActionShowFlyingSign).xdb -> "
+                                     "/Scripts/B.(ActionShowFlyingSign).xdb -> "
+                                     "/scripts/a.(ActionShowFlyingSign).xdb. Check links logic.")
+
+
+def test_looping_dialog(inspect):
+    first = 'First.(TalkboxSheet).xdb#xpointer(/TalkboxSheet)'
+    second = 'Second.(TalkboxSheet).xdb#xpointer(/TalkboxSheet)'
+    inspector = inspect({
+        'Scripts/Sign.(ActionShowFlyingSign).xdb': flyingSign(),
+        'Dialogs/First.(TalkboxSheet).xdb': sheet(('', second)),
+        'Dialogs/Second.(TalkboxSheet).xdb': sheet(('', first), ('', second)),
+        'Dialogs/Dialog.(ActionShowBranchedDialog).xdb': dialog(SIGN, first),
+    })
+    script = actions_handler.ActionShowBranchedDialog.fromGameFile(
+        '/Dialogs/Dialog.(ActionShowBranchedDialog).xdb', inspector).toScript()
+    tables = [line.strip() for line in script if line.strip().endswith(' = {') and 'Dialogs.' in line]
+    assert tables == ['BranchedDialog.Dialogs.Dialogs.First = {', 'BranchedDialog.Dialogs.Dialogs.Second = {']
+    assert sum('following = "BranchedDialog.Dialogs.Dialogs.First"' in line for line in script) == 1
+    assert sum('following = "BranchedDialog.Dialogs.Dialogs.Second"' in line for line in script) == 2
+
+
+def test_shared_action_emitted_once(inspect):
+    start = 'Start.(TalkboxSheet).xdb#xpointer(/TalkboxSheet)'
+    inspector = inspect({
+        'Scripts/Sign.(ActionShowFlyingSign).xdb': flyingSign(),
+        'Dialogs/Start.(TalkboxSheet).xdb': sheet((SIGN, ''), (SIGN.replace('/Scripts/Sign', '/SCRIPTS/sign'), ''), (SIGN, '')),
+        'Dialogs/Dialog.(ActionShowBranchedDialog).xdb': dialog(SIGN, start),
+    })
+    dialog_brick = actions_handler.ActionShowBranchedDialog.fromGameFile(
+        '/Dialogs/Dialog.(ActionShowBranchedDialog).xdb', inspector)
+    for _ in range(2):
+        script = dialog_brick.toScript()
+        assert script[0] == 'function Brick_scripts_sign__actionshowflyingsign(hero, player)'
+        assert sum(line.startswith('function ') for line in script) == 1
+        assert sum(line.strip() == 'Brick_scripts_sign__actionshowflyingsign(hero, player)' for line in script) == 4
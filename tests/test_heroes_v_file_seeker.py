@@ -0,0 +1,120 @@
+import asyncio
+import os
+import zipfile
+import pytest
+from src.scripts.heroes_v_file_seeker import AmbiguousPathError, HeroesVFileInspector
+
+
+def writeArchive(path, files):
+    # 'files' as {name: (year, contents)}
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, (year, contents) in files.items():
+            archive.writestr(zipfile.ZipInfo(name, (year, 1, 1, 0, 0, 0)), contents, zipfile.ZIP_DEFLATED)
+
+
+@pytest.fixture
+def game_root(tmp_path):
+    root = tmp_path / 'game'
+    for folder in ('bin', 'data', 'UserMODs'):
+        os.makedirs(root / folder)
+    writeArchive(root / 'data' / 'data.pak', {
+        'GameMechanics/B.xdb': (2005, b'<B>pak</B>'),
+        'Maps/A.xdb': (2005, b'<A/>'),
+    })
+    return root
+
+
+@pytest.fixture
+def inspect(tmp_path):
+    inspectors = []
+
+    def create(root, **kwargs):
+        inspector = HeroesVFileInspector(str(root), catalog_file=str(tmp_path / 'index' / 'catalog.sqlite'),
+                                         inflate_cache_dir=None, **kwargs)
+        inspectors.append(inspector)
+        return inspector
+
+    yield create
+    for inspector in inspectors:
+        inspector.close()
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_override_in_other_case(game_root, inspect, indexed):
+    writeArchive(game_root / 'UserMODs' / 'mod.h5u', {'gamemechanics/b.xdb': (2007, b'<B>mod</B>')})
+    inspector = inspect(game_root)
+    if indexed:
+        inspector.updateIndexes()
+    assert inspector.get_bytes('GameMechanics/B.xdb') == b'<B>mod</B>'
+    assert inspector.get_bytes('GAMEMECHANICS/B.XDB') == b'<B>mod</B>'
+    assert inspector.casefold_table['gamemechanics/b.xdb'] == ['gamemechanics/b.xdb']
+
+
+def test_older_override_in_other_case(game_root, inspect):
+    writeArchive(game_root / 'UserMODs' / 'mod.h5u', {'gamemechanics/b.xdb': (2001, b'<B>mod</B>')})
+    inspector = inspect(game_root)
+    assert inspector.get_bytes('gamemechanics/b.xdb') == b'<B>pak</B>'
+
+
+def test_ambiguous_path_of_single_source(game_root, inspect):
+    writeArchive(game_root / 'UserMODs' / 'mod.h5u', {
+        'Text/C.txt': (2007, b'C'),
+        'text/c.txt': (2007, b'c'),
+    })
+    inspector = inspect(game_root)
+    assert inspector.get_bytes('Text/C.txt') == b'C'
+    with pytest.raises(AmbiguousPathError):
+        inspector.get_bytes('TEXT/C.TXT')
+
+
+def test_directory_in_several_cases(game_root, inspect):
+    writeArchive(game_root / 'UserMODs' / 'mod.h5u', {
+        'maps/B.xdb': (2007, b'<B/>'),
+        'maps/new/C.xdb': (2007, b'<C/>'),
+    })
+    inspector = inspect(game_root)
+    assert inspector.listdir('') == ['GameMechanics', 'Maps']
+    assert inspector.listdir('Maps') == ['A.xdb', 'B.xdb', 'new']
+    assert inspector.listdir('MAPS') == ['A.xdb', 'B.xdb', 'new']
+    assert inspector.listdir('MAPS/NEW') == ['C.xdb']
+    assert inspector.glob('mAps/*.xdb') == ['Maps/A.xdb', 'Maps/B.xdb']
+    assert inspector.get_bytes('Maps/B.xdb') == b'<B/>'
+    assert [directory for directory, _, _ in inspector.walk()] == ['', 'GameMechanics', 'Maps', 'Maps/new']
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_changed_archive(game_root, inspect, indexed):
+    mod = game_root / 'UserMODs' / 'm.h5u'
+    writeArchive(mod, {'F/0000.xdb': (2007, b'<F>first</F>')})
+    inspector = inspect(game_root)
+    if indexed:
+        inspector.updateIndexes()
+    assert inspector.get_bytes('F/0000.xdb') == b'<F>first</F>'
+    writeArchive(mod, {
+        'E/0000.xdb': (2007, b'<E>added before</E>' * 10),
+        'F/0000.xdb': (2007, b'<F>second version</F>'),
+    })
+    inspector.refresh()
+    assert inspector.get_bytes('F/0000.xdb') == b'<F>second version</F>'
+    assert inspector.get('F/0000.xdb') == [b'<F>second version</F>']
+
+
+def test_async_reads_of_paths_in_several_cases(game_root, inspect):
+    writeArchive(game_root / 'UserMODs' / 'mod.h5u', {
+        'Text/C.txt': (2007, b'UPPER'),
+        'text/c.txt': (2007, b'lower'),
+    })
+    inspector = inspect(game_root, thread_safe=True)
+
+    async def read():
+        contents = await inspector.aget_many(['Text/C.txt', 'text/c.txt', 'Maps/A.xdb', 'maps/a.xdb'])
+        with pytest.raises(AmbiguousPathError):
+            await asyncio.gather(inspector.aget('Text/C.txt'), inspector.aget('TEXT/C.TXT'))
+        return contents
+
+    assert asyncio.run(read()) == {
+        'Text/C.txt': [b'UPPER'],
+        'text/c.txt': [b'lower'],
+        'Maps/A.xdb': [b'<A/>'],
+        'maps/a.xdb': [b'<A/>'],
+    }
@@ -0,0 +1,29 @@
+import os
+import zipfile
+from src.scripts.heroes_v_file_seeker import HeroesVFileInspector
+from src.scripts.href_index import HrefIndex, parseHrefs
+
+
+def test_xpointer_targets():
+    contents = b'<A><B href="b.xdb#xpointer(/B)"/><Link><XPointer> /C/c.xdb#xpointer(/C) </XPointer></Link>' \
+               b'<Inline href="#n:inline(D)"/><XPointer/></A>'
+    assert parseHrefs('Maps/A.xdb', contents) == ['C/c.xdb', 'Maps/b.xdb']
+
+
+def test_referrers(tmp_path):
+    root = tmp_path / 'game'
+    for folder in ('bin', 'data', 'UserMODs'):
+        os.makedirs(root / folder)
+    with zipfile.ZipFile(root / 'data' / 'data.pak', 'w') as archive:
+        archive.writestr('A/a.xdb', '<A><Target><XPointer>/C/c.xdb#xpointer(/C)</XPointer></Target></A>')
+        archive.writestr('B/b.xdb', '<B><Target href="/c/C.xdb#xpointer(/C)"/></B>')
+        archive.writestr('C/c.xdb', '<C/>')
+    inspector = HeroesVFileInspector(str(root), catalog_file=str(tmp_path / 'index' / 'catalog.sqlite'),
+                                     inflate_cache_dir=None)
+    try:
+        index = HrefIndex(inspector)
+        index.update()
+        assert index.referrers('/C/c.xdb') == {'A/a.xdb', 'B/b.xdb'}
+        assert index.references('A/a.xdb') == {'C/c.xdb'}
+    finally:
+        inspector.close()
@@ -0,0 +1,37 @@
+from src.scripts.file_seeker import ArchiveEntry
+from src.scripts.overlay_catalog import OverlayCatalog
+
+
+def entry(name, mtime, header_offset=0, size=10, CRC=1):
+    return ArchiveEntry(name, header_offset, size, size, 8, CRC, mtime)
+
+
+def test_winners(tmp_path):
+    catalog = OverlayCatalog(str(tmp_path / 'catalog.sqlite'))
+    catalog.updateSource('data.pak', 'a', 0, [entry('Maps/A.xdb', 1.0), entry('Text/B.txt', 1.0)])
+    catalog.updateSource('mod.h5u', 'b', 1, [entry('Maps/A.xdb', 2.0), entry('Text/B.txt', 1.0)])
+    sources = {path: source_id for path, (source_id, _, _) in catalog.sources().items()}
+    source_ids = sources.values()
+    try:
+        assert catalog.winner('/Maps/A.xdb', source_ids) == ('Maps/A.xdb', 'Maps/A.xdb', 2.0, sources['mod.h5u'])
+        assert catalog.winner('Text/B.txt', source_ids)[3] == sources['data.pak']
+        assert catalog.winner('Missing.txt', source_ids) is None
+        assert catalog.winners(source_ids, 'Maps/') == [('Maps/A.xdb', 'Maps/A.xdb', 2.0, sources['mod.h5u'])]
+        assert len(catalog.winners(source_ids)) == 2
+    finally:
+        catalog.close()
+
+
+def test_update_of_shifted_entries(tmp_path):
+    catalog = OverlayCatalog(str(tmp_path / 'catalog.sqlite'))
+    entries = [entry(f'F/{number:03}.xdb', 1.0, number * 100) for number in range(200)]
+    catalog.updateSource('mod.h5u', 'a', 0, entries)
+    # The first entry grows, so all the next ones are shifted
+    entries = [entry('F/000.xdb', 2.0, 0, 20, 2)] + [shifted._replace(header_offset=shifted.header_offset + 10)
+                                                     for shifted in entries[1:]]
+    try:
+        assert catalog.updateSource('mod.h5u', 'b', 0, entries) == (set(), set(), {'F/000.xdb'})
+        source_id = catalog.sources()['mod.h5u'][0]
+        assert catalog.entries(source_id) == entries
+    finally:
+        catalog.close()